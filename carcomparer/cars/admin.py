@@ -1,30 +1,104 @@
 from django.contrib import admin
 from django.apps import apps
 from .models import *
+from .pagination import EstimatedCountPaginator
 
 # Replace 'car' with the name of your app
 app_config = apps.get_app_config("cars")
 
 
+class CatalogAdmin(admin.ModelAdmin):
+    """
+    Admin for the large catalog tables.
+
+    ``related`` lists the relations ``__str__`` walks. They are joined into
+    every admin queryset, including autocomplete results, so a page costs
+    the same number of queries however many rows it shows. Row counts are
+    estimated and the extra unfiltered count is skipped.
+    """
+
+    related = []
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(*self.related)
+
+
 @admin.register(Manufacturer)
-class CarManufacturerAdmin(admin.ModelAdmin):
+class ManufacturerAdmin(admin.ModelAdmin):
     search_fields = ["name"]
+    list_display = ["name", "country", "founded_date"]
 
 
 @admin.register(Model)
-class CarManufacturerAdmin(admin.ModelAdmin):
+class CarModelAdmin(CatalogAdmin):
+    related = ["manufacturer", "vehicle_type"]
     search_fields = ["manufacturer__name", "name"]
+    list_display = ["name", "manufacturer", "vehicle_type"]
     list_filter = ["manufacturer", "vehicle_type"]
+    autocomplete_fields = ["manufacturer"]
+
+
+@admin.register(ModelYear)
+class ModelYearAdmin(CatalogAdmin):
+    related = ["model__manufacturer"]
+    search_fields = ["model__manufacturer__name", "model__name", "=year"]
+    list_display = ["__str__", "year"]
+    list_filter = ["year"]
+    autocomplete_fields = ["model"]
 
 
 @admin.register(Variation)
-class CarManufacturerAdmin(admin.ModelAdmin):
+class VariationAdmin(CatalogAdmin):
+    related = ["model_year__model__manufacturer", "current_price"]
     search_fields = [
         "model_year__model__manufacturer__name",
         "model_year__model__name",
         "name",
     ]
+    list_display = ["__str__", "name", "current_price_value"]
     list_filter = ["model_year__model__manufacturer", "model_year__model__vehicle_type"]
+    autocomplete_fields = ["model_year"]
+    # Maintained by Price.save, and a dropdown would load every price
+    readonly_fields = ["current_price"]
+
+    @admin.display(description="Current price", ordering="current_price__price")
+    def current_price_value(self, variation):
+        return variation.current_price.price if variation.current_price else None
+
+
+@admin.register(Price)
+class PriceAdmin(CatalogAdmin):
+    related = ["car__model_year__model__manufacturer"]
+    list_display = ["car", "price", "currency", "first_seen", "date"]
+    list_filter = ["currency"]
+    search_fields = ["=car__id"]
+    raw_id_fields = ["car"]
+
+
+@admin.register(PriceRollup)
+class PriceRollupAdmin(CatalogAdmin):
+    list_display = ["car_id", "period", "start", "avg_price", "samples"]
+    list_filter = ["period"]
+    raw_id_fields = ["car"]
+
+
+@admin.register(FuelEconomy)
+class FuelEconomyAdmin(CatalogAdmin):
+    related = ["car__model_year__model__manufacturer"]
+    list_display = ["car", "engine", "transmission", "fuel_type", "combined_mpg"]
+    list_filter = ["fuel_type", "drive"]
+    search_fields = ["=car__id", "=vehicle_id"]
+    raw_id_fields = ["car"]
+
+
+@admin.register(VariationComparison)
+class VariationComparisonAdmin(CatalogAdmin):
+    search_fields = ["full_name"]
+    list_display = ["full_name", "vehicle_type_name", "current_price", "tco_5_year"]
+    list_filter = ["year"]
+    raw_id_fields = ["variation", "manufacturer", "model"]
 
 
 for model in app_config.get_models():
@@ -0,0 +1,111 @@
+"""
+Set-based write helpers for the scrapers.
+
+These replace per-row ``get_or_create`` loops with a constant number of
+queries per batch: one to find existing rows, one ``INSERT ... ON CONFLICT DO
+NOTHING`` for the missing ones and one to resolve their ids.
+"""
+
+from django.db import connection
+from django.db.models.functions import Lower, Trim
+from .models import Manufacturer
+
+
+def _fetch(model, fields, keys):
+    """Return {key: instance} for the rows of ``model`` matching ``keys``"""
+    if not keys:
+        return {}
+    # One query over the cartesian superset of the key columns, narrowed in python
+    lookup = {
+        f"{field}__in": {key[i] for key in keys} for i, field in enumerate(fields)
+    }
+    found = {}
+    for instance in model.objects.filter(**lookup):
+        key = tuple(getattr(instance, field) for field in fields)
+        if key in keys:
+            found[key] = instance
+    return found
+
+
+def _insert(model, fields, keys):
+    """
+    Insert the rows of ``keys``, skipping conflicting ones, and return the
+    keys this statement inserted. Other columns are left NULL.
+    """
+    columns = [model._meta.get_field(field) for field in fields]
+    names = ", ".join(column.column for column in columns)
+    arrays = ", ".join(f"%s::{column.db_type(connection)}[]" for column in columns)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {model._meta.db_table} ({names})
+            SELECT * FROM unnest({arrays})
+            ON CONFLICT DO NOTHING
+            RETURNING {names}
+            """,
+            [list(values) for values in zip(*keys)],
+        )
+        return {tuple(row) for row in cursor.fetchall()}
+
+
+def bulk_get_or_create(model, fields, keys, batch_size=1000):
+    """
+    Bulk ``get_or_create`` for ``model`` on the unique columns ``fields``.
+
+    ``keys`` is an iterable of value tuples in the order of ``fields``, e.g.
+    ``bulk_get_or_create(Model, ("manufacturer_id", "name"), [(1, "Camry")])``.
+    Returns ``({key: instance}, created_keys)``. Rows inserted concurrently by
+    another worker are picked up rather than duplicated, they just are not
+    reported as created. Columns outside ``fields`` must be nullable.
+    """
+    keys = set(keys)
+    instances = _fetch(model, fields, keys)
+    missing = list(keys - instances.keys())
+    created = set()
+    for i in range(0, len(missing), batch_size):
+        created |= _insert(model, fields, missing[i : i + batch_size])
+    if missing:
+        instances.update(_fetch(model, fields, set(missing)))
+    return instances, created
+
+
+def manufacturer_key(name):
+    """Python side of the unique lower(btrim(name)) index on Manufacturer"""
+    return name.strip().lower()
+
+
+def get_or_create_manufacturers(names):
+    """
+    Bulk ``get_or_create`` for manufacturers in two statements.
+
+    Names match case and surrounding whitespace insensitively, e.g. "TOYOTA "
+    finds "Toyota". ``INSERT ... ON CONFLICT DO NOTHING RETURNING`` gives the
+    rows this call created without writing or locking existing ones, a
+    second query looks up the rest. A conflicting insert waits for the other
+    transaction, so concurrent workers can never create a duplicate or miss
+    each other's rows. Returns ``({name: manufacturer}, created_names)``.
+    """
+    names = set(names)
+    if not names:
+        return {}, set()
+
+    inserted = Manufacturer.objects.raw(
+        """
+        INSERT INTO cars_manufacturer (name, country)
+        SELECT DISTINCT ON (lower(name)) name, ''
+        FROM unnest(%s::text[]) AS name
+        ON CONFLICT ((lower(btrim(name)))) DO NOTHING
+        RETURNING *
+        """,
+        [sorted({name.strip() for name in names})],
+    )
+    by_key = {manufacturer_key(m.name): m for m in inserted}
+    created_keys = set(by_key)
+    missing = {manufacturer_key(name) for name in names} - created_keys
+    if missing:
+        existing = Manufacturer.objects.annotate(key=Lower(Trim("name")))
+        by_key.update((m.key, m) for m in existing.filter(key__in=missing))
+
+    instances = {name: by_key[manufacturer_key(name)] for name in names}
+    created = {name for name in names if manufacturer_key(name) in created_keys}
+    return instances, created
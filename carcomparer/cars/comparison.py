@@ -0,0 +1,114 @@
+"""
+Maintenance of the denormalized VariationComparison table.
+
+Rows are rebuilt in batches: one query loads a batch of variations with
+their model, manufacturer, vehicle type and current price, the derived
+metrics are computed for the whole batch with the TCO engine and the rows
+are written back with a single upsert.
+"""
+
+from decimal import Decimal
+from itertools import islice
+
+import numpy as np
+from .models import Variation, VariationComparison
+from .tco import Assumptions, compute_tco
+
+# Assumptions behind the precomputed tco_5_year column
+COMPARISON_ASSUMPTIONS = Assumptions(years=5)
+
+UPDATE_FIELDS = [
+    "manufacturer",
+    "manufacturer_name",
+    "model",
+    "model_name",
+    "year",
+    "vehicle_type_name",
+    "name",
+    "full_name",
+    "search_document",
+    "current_price",
+    "price_date",
+    "tco_5_year",
+    "refreshed",
+]
+
+
+def search_document(manufacturer, model, name, year):
+    """Text the search index matches, see cars.search"""
+    return f"{manufacturer} {model} {name} {year}".lower()
+
+
+def _money(value):
+    return None if np.isnan(value) else Decimal(f"{value:.2f}")
+
+
+def _build_rows(variations):
+    prices = np.array(
+        [
+            float(variation.current_price.price) if variation.current_price else np.nan
+            for variation in variations
+        ]
+    )
+    mpg = [variation.mpg or COMPARISON_ASSUMPTIONS.mpg for variation in variations]
+    result = compute_tco(prices, mpg, COMPARISON_ASSUMPTIONS)
+
+    rows = []
+    for variation, tco in zip(variations, result.total):
+        model = variation.model_year.model
+        current_price = variation.current_price
+        rows.append(
+            VariationComparison(
+                variation=variation,
+                manufacturer_id=model.manufacturer_id,
+                manufacturer_name=model.manufacturer.name,
+                model=model,
+                model_name=model.name,
+                year=variation.model_year.year,
+                vehicle_type_name=model.vehicle_type.name if model.vehicle_type else "",
+                name=variation.name,
+                full_name=variation.full_name,
+                search_document=search_document(
+                    model.manufacturer.name,
+                    model.name,
+                    variation.name,
+                    variation.model_year.year,
+                ),
+                current_price=current_price.price if current_price else None,
+                price_date=current_price.date if current_price else None,
+                tco_5_year=_money(tco),
+            )
+        )
+    return rows
+
+
+def refresh_comparisons(variations=None, batch_size=1000):
+    """
+    Rebuild the comparison rows of ``variations``, a Variation queryset.
+
+    Without a queryset every row is rebuilt. Returns the number of rows
+    written.
+    """
+    if variations is None:
+        variations = Variation.objects.all()
+
+    variations = (
+        variations.with_current_price()
+        .with_mpg()
+        .select_related(
+            "model_year__model__manufacturer", "model_year__model__vehicle_type"
+        )
+        .order_by("pk")
+        .iterator(chunk_size=batch_size)
+    )
+
+    refreshed = 0
+    while batch := list(islice(variations, batch_size)):
+        VariationComparison.objects.bulk_create(
+            _build_rows(batch),
+            update_conflicts=True,
+            unique_fields=["variation"],
+            update_fields=UPDATE_FIELDS,
+        )
+        refreshed += len(batch)
+    return refreshed
@@ -0,0 +1,162 @@
+"""
+Set-based removal of duplicate catalog rows.
+
+Duplicates are found level by level with window functions, each level
+keyed on its parent's survivor so that e.g. two "Camry" models of two
+duplicate "Toyota" manufacturers are duplicates too. The lowest id of each
+group survives. Children of the losers are moved to the survivors and the
+losers are deleted, each step one statement over the whole table.
+"""
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from .comparison import refresh_comparisons
+from .models import Variation
+from .price_history import reassign_rollups
+
+# (label, map table, rows, grouping key), parents first. Map tables hold the
+# (old_id, new_id) pairs of one level for the rest of the transaction.
+LEVELS = [
+    (
+        "manufacturers",
+        "dedup_manufacturer",
+        "cars_manufacturer t",
+        "lower(btrim(t.name))",
+    ),
+    (
+        "models",
+        "dedup_model",
+        "cars_model t LEFT JOIN dedup_manufacturer p ON p.old_id = t.manufacturer_id",
+        "COALESCE(p.new_id, t.manufacturer_id), t.name",
+    ),
+    (
+        "model years",
+        "dedup_modelyear",
+        "cars_modelyear t LEFT JOIN dedup_model p ON p.old_id = t.model_id",
+        "COALESCE(p.new_id, t.model_id), t.year",
+    ),
+    (
+        "variations",
+        "dedup_variation",
+        "cars_variation t LEFT JOIN dedup_modelyear p ON p.old_id = t.model_year_id",
+        "COALESCE(p.new_id, t.model_year_id), t.name",
+    ),
+]
+
+# Run once the maps exist, deepest level first
+MERGE = [
+    # Prices and fuel economy move to the surviving variation
+    """
+    UPDATE cars_price SET car_id = m.new_id
+    FROM dedup_variation m WHERE cars_price.car_id = m.old_id
+    """,
+    """
+    UPDATE cars_fueleconomy SET car_id = m.new_id
+    FROM dedup_variation m WHERE cars_fueleconomy.car_id = m.old_id
+    """,
+    """
+    DELETE FROM cars_variationcomparison
+    USING dedup_variation m WHERE cars_variationcomparison.variation_id = m.old_id
+    """,
+    "DELETE FROM cars_variation USING dedup_variation m WHERE id = m.old_id",
+    # Surviving children of a duplicate follow their parent's survivor
+    """
+    UPDATE cars_variation SET model_year_id = m.new_id
+    FROM dedup_modelyear m WHERE cars_variation.model_year_id = m.old_id
+    """,
+    "DELETE FROM cars_modelyear USING dedup_modelyear m WHERE id = m.old_id",
+    """
+    UPDATE cars_modelyear SET model_id = m.new_id
+    FROM dedup_model m WHERE cars_modelyear.model_id = m.old_id
+    """,
+    """
+    UPDATE cars_variationcomparison SET model_id = m.new_id
+    FROM dedup_model m WHERE cars_variationcomparison.model_id = m.old_id
+    """,
+    "DELETE FROM cars_model USING dedup_model m WHERE id = m.old_id",
+    """
+    UPDATE cars_model SET manufacturer_id = m.new_id
+    FROM dedup_manufacturer m WHERE cars_model.manufacturer_id = m.old_id
+    """,
+    """
+    UPDATE cars_variationcomparison SET manufacturer_id = m.new_id
+    FROM dedup_manufacturer m WHERE cars_variationcomparison.manufacturer_id = m.old_id
+    """,
+    "DELETE FROM cars_manufacturer USING dedup_manufacturer m WHERE id = m.old_id",
+]
+
+
+def _build_map(cursor, table, rows, key):
+    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    cursor.execute(
+        f"""
+        CREATE TEMP TABLE {table} ON COMMIT DROP AS
+        SELECT id AS old_id, survivor AS new_id FROM (
+            SELECT t.id, first_value(t.id) OVER (
+                PARTITION BY {key} ORDER BY t.id
+            ) AS survivor
+            FROM {rows}
+        ) ranked
+        WHERE id <> survivor
+        """
+    )
+    cursor.execute(f"CREATE UNIQUE INDEX ON {table} (old_id)")
+    cursor.execute(f"ANALYZE {table}")
+    cursor.execute(f"SELECT count(*), count(DISTINCT new_id) FROM {table}")
+    return cursor.fetchone()
+
+
+def _survivors(table):
+    return RawSQL(f"SELECT new_id FROM {table}", [])
+
+
+def find_duplicates(cursor):
+    """
+    Build the map tables of every level.
+
+    Returns {label: (duplicates, rows they will be merged into)}.
+    """
+    return {
+        label: _build_map(cursor, table, rows, key)
+        for label, table, rows, key in LEVELS
+    }
+
+
+def merge_duplicates(cursor):
+    """
+    Move children to the survivors and delete the duplicates.
+
+    Rollups are merged too. Current prices and comparison rows of the
+    survivors are left for the caller to refresh.
+    """
+    reassign_rollups(cursor, "dedup_variation")
+    for statement in MERGE:
+        cursor.execute(statement)
+
+
+def remove_duplicates(dry_run=False):
+    """
+    Merge duplicate manufacturers, models, model years and variations.
+
+    Returns {label: (duplicates removed, rows they were merged into)}. With
+    ``dry_run`` the duplicates are only counted.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        stats = find_duplicates(cursor)
+        if dry_run:
+            transaction.set_rollback(True)
+            return stats
+
+        merge_duplicates(cursor)
+
+        # Merged prices and renamed parents change the survivors' derived data
+        affected = Variation.objects.filter(
+            Q(pk__in=_survivors("dedup_variation"))
+            | Q(model_year__in=_survivors("dedup_modelyear"))
+            | Q(model_year__model__in=_survivors("dedup_model"))
+            | Q(model_year__model__manufacturer__in=_survivors("dedup_manufacturer"))
+        )
+        affected.refresh_current_prices()
+        refresh_comparisons(affected)
+    return stats
@@ -0,0 +1,279 @@
+"""
+Bulk load of the fueleconomy.gov vehicles dataset.
+
+fueleconomy.gov publishes every vehicle since 1984 as one CSV file
+(vehicles.csv, also offered zipped). The file is streamed row by row
+straight into a temporary staging table with ``COPY``, then manufacturers,
+models, model years, variations and their ``FuelEconomy`` rows are
+inserted from it with one set-based statement per table. Existing rows are
+matched the same way the scrapers match them, so loading the dataset and
+scraping the API fill the same catalog.
+"""
+
+import csv
+import io
+import zipfile
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+from .comparison import refresh_comparisons
+from .models import Variation
+
+STAGING_COLUMNS = [
+    "vehicle_id",
+    "year",
+    "make",
+    "model",
+    "variation",
+    "fuel_type",
+    "engine",
+    "transmission",
+    "drive",
+    "city_mpg",
+    "highway_mpg",
+    "combined_mpg",
+]
+
+# Longest name the catalog columns hold
+NAME_LENGTH = 100
+
+# Each step inserts the rows a level is missing, then stores the id of every
+# staging row's row at that level for the next one. (label, insert, resolve)
+LEVELS = [
+    (
+        "manufacturers",
+        """
+        INSERT INTO cars_manufacturer (name, country)
+        SELECT DISTINCT ON (lower(btrim(make))) make, ''
+        FROM fueleconomy_staging
+        ORDER BY lower(btrim(make)), make
+        ON CONFLICT ((lower(btrim(name)))) DO NOTHING
+        """,
+        """
+        UPDATE fueleconomy_staging s SET manufacturer_id = m.id
+        FROM cars_manufacturer m WHERE lower(btrim(m.name)) = lower(btrim(s.make))
+        """,
+    ),
+    # Model names match case and whitespace insensitively, like ModelIndex
+    (
+        "models",
+        """
+        INSERT INTO cars_model (manufacturer_id, name)
+        SELECT DISTINCT ON (s.manufacturer_id, lower(btrim(s.model)))
+            s.manufacturer_id, s.model
+        FROM fueleconomy_staging s
+        WHERE NOT EXISTS (
+            SELECT FROM cars_model m
+            WHERE m.manufacturer_id = s.manufacturer_id
+            AND lower(btrim(m.name)) = lower(btrim(s.model))
+        )
+        ORDER BY s.manufacturer_id, lower(btrim(s.model)), s.model
+        ON CONFLICT (manufacturer_id, name) DO NOTHING
+        """,
+        """
+        UPDATE fueleconomy_staging s SET model_id = m.id
+        FROM (
+            SELECT DISTINCT ON (manufacturer_id, lower(btrim(name)))
+                id, manufacturer_id, lower(btrim(name)) AS name
+            FROM cars_model
+            ORDER BY manufacturer_id, lower(btrim(name)), id
+        ) m
+        WHERE m.manufacturer_id = s.manufacturer_id
+        AND m.name = lower(btrim(s.model))
+        """,
+    ),
+    (
+        "model years",
+        """
+        INSERT INTO cars_modelyear (model_id, year)
+        SELECT DISTINCT model_id, year FROM fueleconomy_staging
+        ON CONFLICT (model_id, year) DO NOTHING
+        """,
+        """
+        UPDATE fueleconomy_staging s SET model_year_id = y.id
+        FROM cars_modelyear y WHERE y.model_id = s.model_id AND y.year = s.year
+        """,
+    ),
+    (
+        "variations",
+        """
+        INSERT INTO cars_variation (model_year_id, name)
+        SELECT DISTINCT model_year_id, variation FROM fueleconomy_staging
+        ON CONFLICT (model_year_id, name) DO NOTHING
+        """,
+        """
+        UPDATE fueleconomy_staging s SET variation_id = v.id
+        FROM cars_variation v
+        WHERE v.model_year_id = s.model_year_id AND v.name = s.variation
+        """,
+    ),
+]
+
+# A vehicle that is already loaded gets its latest figures
+UPSERT_FUEL_ECONOMY = """
+    INSERT INTO cars_fueleconomy (
+        car_id, vehicle_id, fuel_type, engine, transmission, drive,
+        city_mpg, highway_mpg, combined_mpg
+    )
+    SELECT DISTINCT ON (vehicle_id)
+        variation_id, vehicle_id, COALESCE(fuel_type, ''), COALESCE(engine, ''),
+        COALESCE(transmission, ''), COALESCE(drive, ''),
+        city_mpg, highway_mpg, combined_mpg
+    FROM fueleconomy_staging
+    ORDER BY vehicle_id
+    ON CONFLICT (vehicle_id) DO UPDATE SET
+        car_id = EXCLUDED.car_id,
+        fuel_type = EXCLUDED.fuel_type,
+        engine = EXCLUDED.engine,
+        transmission = EXCLUDED.transmission,
+        drive = EXCLUDED.drive,
+        city_mpg = EXCLUDED.city_mpg,
+        highway_mpg = EXCLUDED.highway_mpg,
+        combined_mpg = EXCLUDED.combined_mpg
+"""
+
+
+@contextmanager
+def open_dataset(path):
+    """Text stream of the CSV at ``path``, or of the CSV inside a ZIP"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            names = [n for n in archive.namelist() if n.lower().endswith(".csv")]
+            if not names:
+                raise ValueError(f"{path} does not contain a CSV file")
+            with archive.open(names[0]) as raw:
+                yield io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+    else:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            yield f
+
+
+def split_model(base_model, model):
+    """
+    (model name, variation name) of a dataset row.
+
+    ``model`` is the full name, e.g. "Camry Hybrid LE" for the base model
+    "Camry". Like ``ModelIndex.match`` whatever follows the model name is
+    the variation, "Base" when nothing does.
+    """
+    base_model = " ".join(base_model.split())
+    model = " ".join(model.split())
+    if not base_model or model.casefold() == base_model.casefold():
+        return base_model or model, "Base"
+    if model.casefold().startswith(base_model.casefold() + " "):
+        return base_model, model[len(base_model) + 1 :]
+    return base_model, model
+
+
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _engine(record):
+    displacement, cylinders = record["displ"].strip(), record["cylinders"].strip()
+    if not displacement or displacement == "NA":
+        return ""
+    return f"{displacement} L {cylinders} cyl" if cylinders else f"{displacement} L"
+
+
+def vehicle_rows(lines, start_year=None, end_year=None):
+    """Staging rows of the vehicles CSV in ``lines``, parsed one at a time"""
+    for record in csv.DictReader(lines):
+        year = int(record["year"])
+        if start_year is not None and year < start_year:
+            continue
+        if end_year is not None and year > end_year:
+            continue
+        model, variation = split_model(record.get("baseModel", ""), record["model"])
+        yield (
+            int(record["id"]),
+            year,
+            record["make"].strip()[:NAME_LENGTH],
+            model[:NAME_LENGTH],
+            variation[:NAME_LENGTH],
+            record["fuelType"].strip(),
+            _engine(record),
+            record["trany"].strip(),
+            record["drive"].strip(),
+            _number(record["city08"]),
+            _number(record["highway08"]),
+            _number(record["comb08"]),
+        )
+
+
+class CopyStream:
+    """
+    File-like source for ``COPY ... FROM STDIN`` that writes ``rows`` as CSV
+    only as fast as the database reads them, so the file is never held in
+    memory whole.
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator="\n")
+
+    def read(self, size=-1):
+        while size < 0 or self.buffer.tell() < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.writer.writerow(row)
+        data = self.buffer.getvalue()
+        if size < 0:
+            size = len(data)
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.buffer.write(data[size:])
+        return data[:size]
+
+
+def load_dataset(lines, start_year=None, end_year=None):
+    """
+    Load the vehicles CSV in ``lines`` into the catalog, in one transaction.
+
+    Returns {label: rows} with the number of vehicles read, of rows created
+    per catalog table and of fuel economy rows written.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Left over when an outer transaction is still open, e.g. in tests
+        cursor.execute("DROP TABLE IF EXISTS fueleconomy_staging")
+        cursor.execute(
+            """
+            CREATE TEMP TABLE fueleconomy_staging (
+                vehicle_id integer, year smallint,
+                make text, model text, variation text,
+                fuel_type text, engine text, transmission text, drive text,
+                city_mpg smallint, highway_mpg smallint, combined_mpg smallint,
+                manufacturer_id bigint, model_id bigint,
+                model_year_id bigint, variation_id bigint
+            ) ON COMMIT DROP
+            """
+        )
+        cursor.copy_expert(
+            f"COPY fueleconomy_staging ({', '.join(STAGING_COLUMNS)}) "
+            "FROM STDIN WITH (FORMAT csv)",
+            CopyStream(vehicle_rows(lines, start_year, end_year)),
+        )
+        cursor.execute("ANALYZE fueleconomy_staging")
+        cursor.execute("SELECT count(*) FROM fueleconomy_staging")
+        stats = {"vehicles": cursor.fetchone()[0]}
+
+        for label, insert, resolve in LEVELS:
+            cursor.execute(insert)
+            stats[label] = cursor.rowcount
+            cursor.execute(resolve)
+
+        cursor.execute(UPSERT_FUEL_ECONOMY)
+        stats["fuel economy rows"] = cursor.rowcount
+
+        # New MPG figures change the cost of ownership of every loaded variation
+        loaded = Variation.objects.filter(
+            pk__in=RawSQL("SELECT variation_id FROM fueleconomy_staging", [])
+        )
+        stats["comparison rows"] = refresh_comparisons(loaded)
+    return stats
@@ -1,9 +1,153 @@
+import argparse
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+from urllib.parse import urlsplit
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import connection, connections, transaction
+from django.db.models import Q
 from datetime import datetime
+from carcomparer.cars.comparison import refresh_comparisons
+from carcomparer.cars.models import ScrapeCheckpoint, Variation
+from .http_cache import ResponseCache
+from .http_client import DEFAULT_TIMEOUT, AsyncHttpClient, HttpClient, Request
+from .metrics import ScrapeMetrics, UnitTimer
+from .parsing import Parse, ParserPool
+from .rate_limit import RateLimiter, RetryPolicy
+
+DAY = 24 * 60 * 60
+
+
+def host_rate(value):
+    """Parse a HOST=RATE command line argument"""
+    host, _, rate = value.partition("=")
+    try:
+        return host, float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected HOST=RATE, got {value!r}")
+
+
+class ScrapeError(Exception):
+    """Raised by a fetch step when a unit failed and should be retried on --resume"""
+
+
+def _phase(request):
+    return "parse" if isinstance(request, Parse) else "network"
+
+
+def run_unit(fetch, send, timer):
+    """
+    Drive a fetch generator to completion with a blocking ``send(request)``.
+
+    Fetch generators yield ``Request`` objects, get a ``Response`` back for each
+    and finally return the payload that is handed to the save step. They may
+    also yield ``Parse`` work and get its result back. Time spent in ``send``
+    counts as network time on ``timer``, time spent in the generator itself
+    and on ``Parse`` work as parse time.
+    """
+    try:
+        with timer.measure("parse"):
+            request = next(fetch)
+        while True:
+            with timer.measure(_phase(request)):
+                response = send(request)
+            with timer.measure("parse"):
+                request = fetch.send(response)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def arun_unit(fetch, send, timer):
+    """``run_unit`` for the async engine, ``send`` is a coroutine function"""
+    try:
+        with timer.measure("parse"):
+            request = next(fetch)
+        while True:
+            with timer.measure(_phase(request)):
+                response = await send(request)
+            with timer.measure("parse"):
+                request = fetch.send(response)
+    except StopIteration as stop:
+        return stop.value
+
+
+class DatabaseWriter:
+    """
+    Funnels save steps from the event loop onto a single writer thread.
+
+    The ORM is synchronous, so the async engine never touches it directly.
+    At most ``max_pending`` saves are queued at once, fetches stall behind a
+    slow database instead of piling payloads up in memory.
+    """
+
+    def __init__(self, max_pending):
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="db-writer"
+        )
+        self.pending = asyncio.Semaphore(max_pending)
+
+    async def submit(self, fn, *args):
+        async with self.pending:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, fn, *args)
+
+    def close(self):
+        # Release the writer thread's database connection before it goes away
+        self.executor.submit(connections.close_all).result()
+        self.executor.shutdown()
 
 
 class BaseAPICommand(BaseCommand):
+    """
+    Base command for the API scrapers.
+
+    A scrape type (e.g. ``models``) is split into units of work, usually one
+    per manufacturer. Subclasses implement it with up to three methods:
+
+    * ``<scrape_type>_units(year)`` lists the units for a year, when it is
+      missing the year is a single unit ``None``
+    * ``fetch_<scrape_type>(year, unit)`` is a generator that yields
+      ``Request`` objects, receives a ``Response`` for each and returns a
+      payload. It must not touch the database so it can run on either engine.
+      HTML is parsed by yielding ``Parse(function, html)``, which runs the
+      function on a worker process (see ``parsing``) and sends back its result.
+    * ``save_<scrape_type>(year, unit, payload)`` writes the payload to the
+      database
+
+    Commands that still define ``scrape_<scrape_type>(year)`` are called with
+    the year directly.
+
+    Every finished unit is recorded as a ``ScrapeCheckpoint``, ``--resume``
+    skips the units a previous run already completed.
+
+    Responses are cached on disk for ``cache_ttl`` seconds, or
+    ``historical_cache_ttl`` when scraping a past year whose data rarely
+    changes. A ``Request`` can set its own ``ttl``.
+
+    Save steps call ``touch`` for the variations they changed, their
+    comparison rows are refreshed once the run is over.
+
+    Requests to each host are limited to ``rate_limits[host]`` per second
+    (``default_rate_limit`` for hosts not listed), shared by all workers.
+    Throttled and failed requests are retried with exponential backoff.
+
+    Request latency, response statuses, the network/parse/save time and
+    queries of each unit, queue depth and the rows reported with
+    ``count_rows`` are collected in ``self.metrics``. ``--metrics`` exports
+    them as JSON or Prometheus text when the run ends.
+    """
+
     help = "Base command for scraping data from APIs"
+    cache_ttl = DAY
+    historical_cache_ttl = 30 * DAY
+    rate_limits = {}
+    default_rate_limit = 5.0
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -32,34 +176,375 @@ class BaseAPICommand(BaseCommand):
             default=10,
             help="Number of workers to use for parallel scraping",
         )
+        parser.add_argument(
+            "--engine",
+            type=str,
+            choices=["threads", "async"],
+            default="threads",
+            help="Run units on a thread pool or on an asyncio event loop",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=100,
+            help="Number of requests in flight at once with --engine=async",
+        )
+        parser.add_argument(
+            "--parse-workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Processes that parse HTML pages, 0 parses on the worker threads",
+        )
+        parser.add_argument(
+            "--connect-timeout",
+            type=float,
+            default=DEFAULT_TIMEOUT[0],
+            help="Seconds to wait for a connection to the API before giving up",
+        )
+        parser.add_argument(
+            "--read-timeout",
+            type=float,
+            default=DEFAULT_TIMEOUT[1],
+            help="Seconds to wait for the API to respond before giving up",
+        )
+        parser.add_argument(
+            "--cache-dir",
+            type=str,
+            default=os.path.join(settings.BASE_DIR, ".scrape_cache"),
+            help="Directory for cached API responses",
+        )
+        parser.add_argument(
+            "--cache-size",
+            type=int,
+            default=1024,
+            help="Maximum size of the response cache in megabytes",
+        )
+        parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="Always fetch from the API and do not cache responses",
+        )
+        parser.add_argument(
+            "--rate-limit",
+            type=host_rate,
+            action="append",
+            default=[],
+            metavar="HOST=RATE",
+            help="Requests per second allowed to HOST, may be given more than once",
+        )
+        parser.add_argument(
+            "--max-retries",
+            type=int,
+            default=3,
+            help="Times to retry a request that failed or was throttled",
+        )
+        parser.add_argument(
+            "--order",
+            type=str,
+            choices=["oldest", "newest"],
+            default="oldest",
+            help="Whether the oldest or the newest years are scraped first",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Skip units that a previous run of this command completed",
+        )
+        parser.add_argument(
+            "--api-base",
+            type=str,
+            help=(
+                "Send requests for https://HOST/PATH to API_BASE/HOST/PATH, "
+                "e.g. the offline replay server of benchmark_scrapers"
+            ),
+        )
+        parser.add_argument(
+            "--metrics",
+            type=str,
+            choices=["json", "prometheus"],
+            help="Export the run's metrics in this format when it ends",
+        )
+        parser.add_argument(
+            "--metrics-file",
+            type=str,
+            help="Write the exported metrics here instead of to stdout",
+        )
 
     def handle(self, *args, **kwargs):
         start_year = kwargs["start_year"]
         end_year = kwargs.get("end_year", start_year)
         scrape_type = kwargs["scrape_type"]
         self.num_workers = kwargs["num_workers"]
+        self.engine = kwargs["engine"]
+        self.concurrency = kwargs["concurrency"]
+        self.resume = kwargs["resume"]
+        self.api_base = kwargs["api_base"]
+        self.touched = defaultdict(set)
+        self.touched_lock = threading.Lock()
+        years = self.get_years(start_year, end_year, kwargs["order"])
+        self.timeout = (kwargs["connect_timeout"], kwargs["read_timeout"])
+        self.cache = None
+        if not kwargs["no_cache"]:
+            self.cache = ResponseCache(
+                kwargs["cache_dir"], max_size=kwargs["cache_size"] * 1024 * 1024
+            )
 
-        # Dynamically call the appropriate scraping function based on scrape_type
-        if hasattr(self, f"scrape_{scrape_type}"):
-            scrape_function = getattr(self, f"scrape_{scrape_type}")
-            for year in range(start_year, end_year + 1):
-                self.stdout.write(f"Scraping {scrape_type} for year: {year}")
-                scrape_function(year)
-        else:
-            self.stdout.write(
-                self.style.ERROR(
-                    f"No scraping function defined for type: {scrape_type}"
+        self.limiter = RateLimiter(
+            {**self.rate_limits, **dict(kwargs["rate_limit"])},
+            self.default_rate_limit,
+        )
+        self.retry = RetryPolicy(max_retries=kwargs["max_retries"])
+        self.metrics = ScrapeMetrics(command=self.command_name, scrape_type=scrape_type)
+
+        # One pooled client for the whole run so workers reuse connections
+        self.http = HttpClient(
+            pool_size=self.num_workers,
+            timeout=self.timeout,
+            cache=self.cache,
+            limiter=self.limiter,
+            retry=self.retry,
+            metrics=self.metrics,
+        )
+        self.parsers = ParserPool(kwargs["parse_workers"])
+
+        try:
+            if hasattr(self, f"fetch_{scrape_type}"):
+                work = self.get_work(scrape_type, years)
+                if self.engine == "async":
+                    asyncio.run(self.run_async(scrape_type, work))
+                else:
+                    self.run_threaded(scrape_type, work)
+                self.refresh_touched()
+                self.report_metrics(kwargs["metrics"], kwargs["metrics_file"])
+            # Dynamically call the appropriate scraping function based on scrape_type
+            elif hasattr(self, f"scrape_{scrape_type}"):
+                scrape_function = getattr(self, f"scrape_{scrape_type}")
+                for year in years:
+                    self.stdout.write(f"Scraping {scrape_type} for year: {year}")
+                    scrape_function(year)
+            else:
+                self.stdout.write(
+                    self.style.ERROR(
+                        f"No scraping function defined for type: {scrape_type}"
+                    )
                 )
+        finally:
+            self.http.close()
+            self.parsers.close()
+
+    @property
+    def command_name(self):
+        return self.__module__.rsplit(".", 1)[-1]
+
+    def get_years(self, start_year, end_year, order):
+        """Years of the run, oldest or newest first"""
+        years = list(range(start_year, end_year + 1))
+        if order == "newest":
+            years.reverse()
+        return years
+
+    def get_units(self, scrape_type, year):
+        units = getattr(self, f"{scrape_type}_units", None)
+        return list(units(year)) if units else [None]
+
+    def get_work(self, scrape_type, years):
+        """
+        Every (year, unit) pair of the run in the order they should be scraped.
+
+        All years go into one queue so workers move on to the next year while
+        the slowest units of the previous one are still running.
+        """
+        work = []
+        for year in years:
+            units = self.get_units(scrape_type, year)
+            if self.resume:
+                units = self.pending_units(scrape_type, year, units)
+            self.stdout.write(
+                f"Queued {len(units)} {scrape_type} units for year: {year}"
             )
+            work.extend((year, unit) for unit in units)
+        return work
+
+    def unit_key(self, unit):
+        return "" if unit is None else str(unit)
+
+    def pending_units(self, scrape_type, year, units):
+        """Drop the units a previous run checkpointed as done"""
+        done = set(
+            ScrapeCheckpoint.objects.filter(
+                command=self.command_name,
+                scrape_type=scrape_type,
+                year=year,
+                status=ScrapeCheckpoint.DONE,
+            ).values_list("unit", flat=True)
+        )
+        pending = [unit for unit in units if self.unit_key(unit) not in done]
+        self.stdout.write(f"Skipping {len(units) - len(pending)} completed units")
+        return pending
+
+    def record(self, scrape_type, year, unit, status, error=""):
+        ScrapeCheckpoint.objects.update_or_create(
+            command=self.command_name,
+            scrape_type=scrape_type,
+            year=year,
+            unit=self.unit_key(unit),
+            defaults={"status": status, "error": error},
+        )
+
+    def prepare_request(self, request, year):
+        """Fill in the command's defaults before a unit's request is sent"""
+        if request.ttl is None:
+            past = year is not None and year < datetime.now().year
+            request.ttl = self.historical_cache_ttl if past else self.cache_ttl
+        if self.api_base:
+            url = urlsplit(request.url)
+            request.url = f"{self.api_base.rstrip('/')}/{url.netloc}{url.path}"
+            if url.query:
+                request.url += f"?{url.query}"
+        return request
+
+    def process_unit(self, scrape_type, year, unit):
+        """Fetch and save one unit on the calling thread"""
+        self.metrics.queue("units", -1)
+        fetch = getattr(self, f"fetch_{scrape_type}")
+
+        def send(request):
+            if isinstance(request, Parse):
+                return self.parsers.run(request)
+            return self.http.fetch(self.prepare_request(request, year))
+
+        timer = UnitTimer()
+        try:
+            payload = run_unit(fetch(year, unit), send, timer)
+            self.save(scrape_type, year, unit, payload, timer)
+        finally:
+            # Pool threads never hand their connection back, so each unit
+            # closes it rather than leaving one session open per thread
+            connection.close()
+
+    def save(self, scrape_type, year, unit, payload, timer):
+        save = getattr(self, f"save_{scrape_type}", None)
+        # The unit only counts as done if its rows made it into the database
+        with timer.measure("save"):
+            # Connect before installing the wrapper: wrappers added when the
+            # connection opens (QueryCounter.attach) would otherwise sit on top
+            # of it and be the one popped when it exits
+            connection.ensure_connection()
+            with connection.execute_wrapper(timer.queries), transaction.atomic():
+                if save and payload is not None:
+                    save(year, unit, payload)
+                self.record(scrape_type, year, unit, ScrapeCheckpoint.DONE)
+        self.metrics.unit_done(timer)
+
+    def count_rows(self, table, created=0, updated=0):
+        """Report rows a save step wrote, e.g. ``self.count_rows("model", created=3)``"""
+        self.metrics.count_rows(table, created, updated)
+
+    def touch(self, lookup, values):
+        """
+        Mark the variations matching ``<lookup>__in=values`` as changed,
+        e.g. ``self.touch("model_year__model", model_ids)``
+        """
+        with self.touched_lock:
+            self.touched[lookup].update(values)
 
-    def scrape_manufacturers(self, year):
-        """Scrape manufacturers - to be overridden by subclass"""
-        raise NotImplementedError("This method should be overridden in a subclass")
+    def refresh_touched(self):
+        if not self.touched:
+            return
+        changed = reduce(
+            or_,
+            (Q(**{f"{lookup}__in": values}) for lookup, values in self.touched.items()),
+        )
+        refreshed = refresh_comparisons(Variation.objects.filter(changed))
+        self.stdout.write(f"Refreshed {refreshed} comparison rows")
 
-    def scrape_models(self, year):
-        """Scrape models - to be overridden by subclass"""
-        raise NotImplementedError("This method should be overridden in a subclass")
+    def report_metrics(self, export, path):
+        summary = self.metrics.summary()
+        units = summary["units"]
+        message = (
+            f"Finished {units.get('done', 0)} units ({units.get('failed', 0)} failed) "
+            f"in {summary['seconds']}s"
+        )
+        if summary["bottleneck"]:
+            message += f", mostly {summary['bottleneck']} bound"
+        self.stdout.write(message)
+        if not export:
+            return
+        if export == "prometheus":
+            text = self.metrics.prometheus()
+        else:
+            text = json.dumps(summary, indent=2)
+        if path:
+            with open(path, "w") as f:
+                f.write(text)
+        else:
+            self.stdout.write(text)
+
+    def fail(self, scrape_type, year, unit, exc):
+        self.metrics.unit_failed()
+        self.report_error(unit, exc)
+        self.record(scrape_type, year, unit, ScrapeCheckpoint.FAILED, str(exc))
+
+    def report_error(self, unit, exc):
+        if isinstance(exc, ScrapeError):
+            self.stdout.write(self.style.ERROR(str(exc)))
+        else:
+            self.stdout.write(self.style.ERROR(f"{unit} generated an exception: {exc}"))
 
-    def scrape_variations(self, year):
-        """Scrape variations - to be overridden by subclass"""
-        raise NotImplementedError("This method should be overridden in a subclass")
+    def run_threaded(self, scrape_type, work):
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            self.metrics.queue("units", len(work))
+            future_to_work = {
+                executor.submit(self.process_unit, scrape_type, year, unit): (
+                    year,
+                    unit,
+                )
+                for year, unit in work
+            }
+            for future in as_completed(future_to_work):
+                try:
+                    future.result()
+                except Exception as exc:
+                    self.fail(scrape_type, *future_to_work[future], exc)
+
+    async def run_async(self, scrape_type, work):
+        fetch = getattr(self, f"fetch_{scrape_type}")
+        writer = DatabaseWriter(max_pending=self.num_workers)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def process_unit(client, year, unit):
+            async def send(request):
+                if isinstance(request, Parse):
+                    return await self.parsers.arun(request)
+                return await client.fetch(self.prepare_request(request, year))
+
+            timer = UnitTimer()
+            try:
+                async with semaphore:
+                    self.metrics.queue("units", -1)
+                    payload = await arun_unit(fetch(year, unit), send, timer)
+                self.metrics.queue("database", 1)
+                try:
+                    await writer.submit(
+                        self.save, scrape_type, year, unit, payload, timer
+                    )
+                finally:
+                    self.metrics.queue("database", -1)
+            except Exception as exc:
+                await writer.submit(self.fail, scrape_type, year, unit, exc)
+
+        self.metrics.queue("units", len(work))
+        try:
+            async with AsyncHttpClient(
+                limit=self.concurrency,
+                timeout=self.timeout,
+                cache=self.cache,
+                limiter=self.limiter,
+                retry=self.retry,
+                metrics=self.metrics,
+            ) as client:
+                await asyncio.gather(
+                    *(process_unit(client, year, unit) for year, unit in work)
+                )
+        finally:
+            writer.close()
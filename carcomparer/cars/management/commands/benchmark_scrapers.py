@@ -0,0 +1,154 @@
+import json
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from carcomparer.cars.models import ScrapeCheckpoint
+from ..metrics import QueryCounter
+from ..replay import FixtureCatalog, ReplayServer
+
+# Run in order, later stages need the rows of the earlier ones
+STAGES = [
+    ("scrape_fueleconomy", "manufacturers"),
+    ("scrape_nhtsa", "models"),
+    ("scrape_nhtsa", "vehicle_types"),
+    ("scrape_fueleconomy", "variations"),
+    ("scrape_wikipedia", "manufacturers"),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the scrapers against an offline replay server in a scratch "
+        "database and reports their throughput"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--manufacturers", type=int, default=20)
+        parser.add_argument("--models", type=int, default=10, help="Per manufacturer")
+        parser.add_argument("--trims", type=int, default=3, help="Per model")
+        parser.add_argument(
+            "--page-kb",
+            type=int,
+            default=200,
+            help="Size of the fake Wikipedia pages",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=50,
+            help="Milliseconds the replay server waits before every response",
+        )
+        parser.add_argument("--year", type=int, default=2023)
+        parser.add_argument(
+            "--engine", type=str, choices=["threads", "async"], default="threads"
+        )
+        parser.add_argument("--num-workers", type=int, default=10)
+        parser.add_argument("--concurrency", type=int, default=100)
+        parser.add_argument(
+            "--output", type=str, help="Also write the results as JSON to this file"
+        )
+        parser.add_argument(
+            "--max-queries-per-unit",
+            type=float,
+            help="Fail if any stage needs more database queries per unit",
+        )
+        parser.add_argument(
+            "--min-requests-per-second",
+            type=float,
+            help="Fail if any stage makes fewer requests per second",
+        )
+
+    def handle(self, *args, **kwargs):
+        catalog = FixtureCatalog(
+            manufacturers=kwargs["manufacturers"],
+            models=kwargs["models"],
+            trims=kwargs["trims"],
+            page_kb=kwargs["page_kb"],
+        )
+
+        # A throwaway database, the same way the test runner makes one
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with ReplayServer(catalog, latency=kwargs["latency"] / 1000) as server:
+                results = [
+                    self.run_stage(server, command, scrape_type, kwargs)
+                    for command, scrape_type in STAGES
+                ]
+
+            # Reported before the teardown, which can fail on its own
+            self.report(results)
+            if kwargs["output"]:
+                with open(kwargs["output"], "w") as f:
+                    json.dump(results, f, indent=2)
+            self.check_thresholds(results, kwargs)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_stage(self, server, command, scrape_type, options):
+        server.requests.clear()
+        started = timezone.now()
+        with QueryCounter() as queries:
+            start = time.perf_counter()
+            call_command(
+                command,
+                scrape_type=scrape_type,
+                start_year=options["year"],
+                end_year=options["year"],
+                engine=options["engine"],
+                num_workers=options["num_workers"],
+                concurrency=options["concurrency"],
+                no_cache=True,
+                api_base=server.url,
+                # Measure the scraper, not the politeness limits
+                rate_limit=[(server.httpd.server_address[0], 1000000.0)],
+                stdout=StringIO(),
+            )
+            wall_time = time.perf_counter() - start
+
+        units = ScrapeCheckpoint.objects.filter(
+            command=command,
+            scrape_type=scrape_type,
+            status=ScrapeCheckpoint.DONE,
+            updated__gte=started,
+        ).count()
+        requests = sum(server.requests.values())
+        return {
+            "stage": f"{command} {scrape_type}",
+            "units": units,
+            "requests": requests,
+            "wall_time": round(wall_time, 3),
+            "requests_per_second": round(requests / wall_time, 1),
+            "queries": queries.count,
+            "queries_per_unit": round(queries.count / max(units, 1), 1),
+            "query_time": round(queries.time, 3),
+        }
+
+    def report(self, results):
+        self.stdout.write(
+            f"{'stage':<36} {'units':>6} {'requests':>9} {'req/s':>8} "
+            f"{'queries/unit':>13} {'db s':>7} {'wall s':>7}"
+        )
+        for r in results:
+            self.stdout.write(
+                f"{r['stage']:<36} {r['units']:>6} {r['requests']:>9} "
+                f"{r['requests_per_second']:>8} {r['queries_per_unit']:>13} "
+                f"{r['query_time']:>7} {r['wall_time']:>7}"
+            )
+
+    def check_thresholds(self, results, options):
+        failures = []
+        for r in results:
+            limit = options["max_queries_per_unit"]
+            if limit is not None and r["queries_per_unit"] > limit:
+                failures.append(f"{r['stage']}: {r['queries_per_unit']} queries/unit")
+            limit = options["min_requests_per_second"]
+            if limit is not None and r["requests"] and r["requests_per_second"] < limit:
+                failures.append(f"{r['stage']}: {r['requests_per_second']} req/s")
+        if failures:
+            raise CommandError("Benchmark regressed: " + ", ".join(failures))
+        self.stdout.write(self.style.SUCCESS("Benchmark finished"))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from carcomparer.cars.tco import Assumptions, tco_for_variations
+
+
+class Command(BaseCommand):
+    help = "Prints the N year cost of ownership of the given variations"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "variations", type=int, nargs="+", help="Ids of the variations to compare"
+        )
+        parser.add_argument(
+            "--years", type=int, default=5, help="Years of ownership, at least 1"
+        )
+        parser.add_argument("--annual-miles", type=float, default=12000)
+        parser.add_argument("--fuel-price", type=float, default=3.50)
+        parser.add_argument(
+            "--mpg",
+            type=float,
+            default=25.0,
+            help="Fuel economy for variations without fueleconomy.gov data",
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["years"] < 1:
+            raise CommandError(f"--years must be at least 1, got {kwargs['years']}")
+        assumptions = Assumptions(
+            years=kwargs["years"],
+            annual_miles=kwargs["annual_miles"],
+            fuel_price=kwargs["fuel_price"],
+            mpg=kwargs["mpg"],
+        )
+        variations, result, missing = tco_for_variations(
+            kwargs["variations"], assumptions
+        )
+
+        # Cheapest to own first
+        for i in result.total.argsort():
+            variation = variations[i]
+            self.stdout.write(
+                f"{variation.full_name}: ${variation.current_price.price} to buy, "
+                f"${result.total[i]:,.2f} over {assumptions.years} years"
+            )
+        for variation_id in missing:
+            self.stdout.write(
+                self.style.WARNING(f"No price for variation {variation_id}")
+            )
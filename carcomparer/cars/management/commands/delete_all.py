@@ -1,13 +1,138 @@
-from django.core.management.base import BaseCommand
-import requests
-import xml.etree.ElementTree as ET
+from functools import reduce
+from operator import or_
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
 from carcomparer.cars.models import *
-from datetime import datetime
+
+# Everything scraped, VehicleType is reference data and survives a reset
+CATALOG_TABLES = [
+    Manufacturer,
+    Model,
+    ModelYear,
+    Variation,
+    Price,
+    PriceRollup,
+    FuelEconomy,
+    VariationComparison,
+    ScrapeCheckpoint,
+]
+
+# Rows below the model years in reset_modelyear, deepest first
+SCOPED_DELETES = [
+    (
+        "prices",
+        """
+        DELETE FROM cars_price USING cars_variation v, reset_modelyear s
+        WHERE cars_price.car_id = v.id AND v.model_year_id = s.id
+        """,
+    ),
+    (
+        "price rollups",
+        """
+        DELETE FROM cars_pricerollup USING cars_variation v, reset_modelyear s
+        WHERE cars_pricerollup.car_id = v.id AND v.model_year_id = s.id
+        """,
+    ),
+    (
+        "fuel economy rows",
+        """
+        DELETE FROM cars_fueleconomy USING cars_variation v, reset_modelyear s
+        WHERE cars_fueleconomy.car_id = v.id AND v.model_year_id = s.id
+        """,
+    ),
+    (
+        "comparison rows",
+        """
+        DELETE FROM cars_variationcomparison USING cars_variation v, reset_modelyear s
+        WHERE cars_variationcomparison.variation_id = v.id AND v.model_year_id = s.id
+        """,
+    ),
+    (
+        "variations",
+        """
+        DELETE FROM cars_variation USING reset_modelyear s
+        WHERE cars_variation.model_year_id = s.id
+        """,
+    ),
+    (
+        "model years",
+        "DELETE FROM cars_modelyear USING reset_modelyear s WHERE cars_modelyear.id = s.id",
+    ),
+]
 
 
 class Command(BaseCommand):
-    help = "Deletes all cars in the database"
+    help = (
+        "Deletes all cars in the database, or only those of some manufacturers "
+        "and years"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--manufacturer",
+            action="append",
+            help="Only delete this manufacturer's cars, may be repeated",
+        )
+        parser.add_argument(
+            "--start-year", type=int, help="Only delete model years from this year"
+        )
+        parser.add_argument(
+            "--end-year", type=int, help="Only delete model years up to this year"
+        )
 
     def handle(self, *args, **kwargs):
-        Manufacturer.objects.all().delete()
-        self.stdout.write(self.style.SUCCESS("All cars have been deleted"))
+        manufacturers = kwargs["manufacturer"]
+        start_year, end_year = kwargs["start_year"], kwargs["end_year"]
+
+        if not manufacturers and start_year is None and end_year is None:
+            self.truncate()
+            self.stdout.write(self.style.SUCCESS("All cars have been deleted"))
+            return
+
+        model_years = ModelYear.objects.all()
+        if manufacturers:
+            ids = list(
+                Manufacturer.objects.filter(
+                    reduce(or_, [Q(name__iexact=name) for name in manufacturers])
+                ).values_list("id", flat=True)
+            )
+            if not ids:
+                raise CommandError(f"No manufacturer named {', '.join(manufacturers)}")
+            model_years = model_years.filter(model__manufacturer__in=ids)
+        if start_year is not None:
+            model_years = model_years.filter(year__gte=start_year)
+        if end_year is not None:
+            model_years = model_years.filter(year__lte=end_year)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            sql, params = model_years.values("id").query.sql_with_params()
+            cursor.execute("DROP TABLE IF EXISTS reset_modelyear")
+            cursor.execute(
+                f"CREATE TEMP TABLE reset_modelyear ON COMMIT DROP AS {sql}", params
+            )
+            for label, statement in SCOPED_DELETES:
+                cursor.execute(statement)
+                self.stdout.write(f"Deleted {cursor.rowcount} {label}")
+
+            # Without a year range the manufacturers go as a whole
+            if manufacturers and start_year is None and end_year is None:
+                cursor.execute(
+                    "DELETE FROM cars_model WHERE manufacturer_id = ANY(%s)", [ids]
+                )
+                self.stdout.write(f"Deleted {cursor.rowcount} models")
+                cursor.execute(
+                    "DELETE FROM cars_manufacturer WHERE id = ANY(%s)", [ids]
+                )
+                self.stdout.write(f"Deleted {cursor.rowcount} manufacturers")
+
+        self.stdout.write(self.style.SUCCESS("Selected cars have been deleted"))
+
+    def truncate(self):
+        tables = ", ".join(model._meta.db_table for model in CATALOG_TABLES)
+        with connection.cursor() as cursor:
+            # TRUNCATE refuses to run with deferred foreign key checks pending,
+            # e.g. when called inside a transaction that wrote catalog rows
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute(f"TRUNCATE {tables} RESTART IDENTITY CASCADE")
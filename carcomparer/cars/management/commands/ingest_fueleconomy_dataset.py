@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from carcomparer.cars.fueleconomy import load_dataset, open_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Loads manufacturers, models, model years, variations and their fuel "
+        "economy from a downloaded copy of fueleconomy.gov's vehicles dataset"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            type=str,
+            help="vehicles.csv or the vehicles.csv.zip it is published as",
+        )
+        parser.add_argument(
+            "--start-year", type=int, help="Skip vehicles older than this year"
+        )
+        parser.add_argument(
+            "--end-year", type=int, help="Skip vehicles newer than this year"
+        )
+
+    def handle(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with open_dataset(kwargs["path"]) as lines:
+                stats = load_dataset(lines, kwargs["start_year"], kwargs["end_year"])
+        except (OSError, KeyError, ValueError) as exc:
+            raise CommandError(f"Could not read {kwargs['path']}: {exc!r}")
+
+        self.stdout.write(f"Read {stats.pop('vehicles')} vehicles")
+        written = stats.pop("fuel economy rows")
+        refreshed = stats.pop("comparison rows")
+        for label, created in stats.items():
+            self.stdout.write(f"Added {created} {label}")
+        self.stdout.write(f"Wrote {written} fuel economy rows")
+        self.stdout.write(f"Refreshed {refreshed} comparison rows")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Loaded the dataset in {time.perf_counter() - start:.1f}s"
+            )
+        )
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from carcomparer.cars.comparison import refresh_comparisons
+from carcomparer.cars.models import Variation
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the precomputed variation comparison table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--manufacturer",
+            type=str,
+            help="Only rebuild the rows of this manufacturer",
+        )
+        parser.add_argument(
+            "--year",
+            type=int,
+            help="Only rebuild the rows of this model year",
+        )
+
+    def handle(self, *args, **kwargs):
+        variations = Variation.objects.all()
+        if kwargs["manufacturer"]:
+            variations = variations.filter(
+                model_year__model__manufacturer__name=kwargs["manufacturer"]
+            )
+        if kwargs["year"]:
+            variations = variations.filter(model_year__year=kwargs["year"])
+
+        refreshed = refresh_comparisons(variations)
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {refreshed} comparison rows"))
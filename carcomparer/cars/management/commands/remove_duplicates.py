@@ -1,30 +1,29 @@
-# this command removes duplicate models from the database
+# this command merges duplicate catalog rows in the database
 
 from django.core.management.base import BaseCommand
-from carcomparer.cars.models import Manufacturer, Model
-from django.db.models import Count
+from carcomparer.cars.dedup import remove_duplicates
 
 
 class Command(BaseCommand):
-    help = "Removes duplicate models from the database"
+    help = (
+        "Merges duplicate manufacturers, models, model years and variations, "
+        "moving their children and prices to the row that is kept"
+    )
 
-    def handle(self, *args, **kwargs):
-        # Annotate models with a count of duplicates based on 'manufacturer', 'name', and 'year'
-        duplicates = (
-            Model.objects.values("manufacturer", "name", "year")
-            .annotate(model_count=Count("id"))
-            .filter(model_count__gt=1)
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report how many duplicates would be merged",
         )
 
-        for duplicate in duplicates:
-            # Fetch the IDs of all models matching the duplicate criteria, except for the first one
-            model_ids_to_delete = Model.objects.filter(
-                manufacturer=duplicate["manufacturer"],
-                name=duplicate["name"],
-                year=duplicate["year"],
-            ).values_list("id", flat=True)[
-                1:
-            ]  # Skip the first one to keep
+    def handle(self, *args, **kwargs):
+        dry_run = kwargs["dry_run"]
+        stats = remove_duplicates(dry_run=dry_run)
 
-            # Delete all models found in the previous step
-            Model.objects.filter(id__in=model_ids_to_delete).delete()
+        verb = "Would merge" if dry_run else "Merged"
+        for label, (duplicates, survivors) in stats.items():
+            style = self.style.WARNING if duplicates else self.style.SUCCESS
+            self.stdout.write(
+                style(f"{verb} {duplicates} duplicate {label} into {survivors}")
+            )
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from carcomparer.cars.price_history import rollup_daily, rollup_weekly
+
+
+class Command(BaseCommand):
+    help = "Downsamples old price history into daily and weekly rollups"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--daily-after",
+            type=int,
+            default=30,
+            help="Roll raw prices older than this many days up into days",
+        )
+        parser.add_argument(
+            "--weekly-after",
+            type=int,
+            default=365,
+            help="Roll daily rollups older than this many days up into weeks",
+        )
+
+    def handle(self, *args, **kwargs):
+        now = timezone.now()
+        prices = rollup_daily(now - timedelta(days=kwargs["daily_after"]))
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {prices} prices into days"))
+
+        days = rollup_weekly((now - timedelta(days=kwargs["weekly_after"])).date())
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {days} days into weeks"))
@@ -1,115 +1,133 @@
-from ..base_scrape import BaseAPICommand
+from ..base_scrape import BaseAPICommand, Request, ScrapeError
 import xml.etree.ElementTree as ET
-from datetime import datetime
+from carcomparer.cars.bulk import bulk_get_or_create, get_or_create_manufacturers
+from carcomparer.cars.model_index import ModelIndex
 from carcomparer.cars.models import *
-import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from django.db.models import Q
+
+# Bytes of a menu response fed to the XML parser at a time
+MENU_CHUNK_SIZE = 16 * 1024
+
+
+def iter_menu_items(response, field):
+    """
+    The ``field`` of every menuItem in a menu response, parsed incrementally.
+
+    Items are yielded as soon as they are closed and dropped from the tree
+    right after, so no more than one is ever held besides the raw response.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root = None
+
+    def read_items():
+        nonlocal root
+        for event, element in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = element
+            elif element.tag == "menuItem":
+                yield element.findtext(field)
+                root.clear()
+
+    for chunk in response.iter_content(MENU_CHUNK_SIZE):
+        parser.feed(chunk)
+        yield from read_items()
+    parser.close()
+    yield from read_items()
 
 
 class ScrapeCarDataCommand(BaseAPICommand):
     help = "Scrapes car data from FuelEconomy.gov"
+    rate_limits = {"www.fueleconomy.gov": 10}
 
-    def scrape_manufacturers(self, year):
+    def fetch_manufacturers(self, year, unit):
         url = f"https://www.fueleconomy.gov/ws/rest/vehicle/menu/make?year={year}"
-        response = requests.get(url)
+        response = yield Request(url)
         if response.status_code != 200:
-            self.stdout.write(
-                self.style.ERROR("Error accessing the FuelEconomy.gov API")
-            )
-            return []
+            raise ScrapeError("Error accessing the FuelEconomy.gov API")
 
-        root = ET.fromstring(response.content)
-        for menuItem in root.findall("menuItem"):
-            name = menuItem.find("value").text
+        return list(iter_menu_items(response, "value"))
 
-            manufacturer, created = Manufacturer.objects.get_or_create(name=name)
-            if created:
+    def save_manufacturers(self, year, unit, names):
+        _, created_names = get_or_create_manufacturers(names)
+        self.count_rows("manufacturer", created=len(created_names))
+        for name in names:
+            if name in created_names:
                 self.stdout.write(self.style.SUCCESS(f"Added new manufacturer: {name}"))
             else:
                 self.stdout.write(self.style.WARNING(f"Existing manufacturer: {name}"))
 
-    def scrape_variations(self, year):
-        manufacturers = Manufacturer.objects.all()
-
-        # Use ThreadPoolExecutor to parallelize requests
-        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
-            futures = [
-                executor.submit(
-                    self.scrape_variations_manufacturer, year, manufacturer.name
-                )
-                for manufacturer in manufacturers
-            ]
-            for future in futures:
-                future.result()  # Wait for all futures to complete
+    def variations_units(self, year):
+        return Manufacturer.objects.values_list("name", flat=True)
 
-    def scrape_variations_manufacturer(self, year, manufacturer_name):
+    def fetch_variations(self, year, manufacturer_name):
         url = f"https://www.fueleconomy.gov/ws/rest/vehicle/menu/model?year={year}&make={manufacturer_name}"
-        response = requests.get(url)
-
-        if response.status_code == 200:
-            root = ET.fromstring(response.content)
-            for menuItem in root.findall("menuItem"):
-                full_model_name = menuItem.find("text").text
-                # Split the full model name into all possible parts
-                parts = full_model_name.split(" ")
-                for i in range(len(parts), 0, -1):
-                    # Attempt to match the model name starting from the longest possible match
-                    potential_model_name = " ".join(parts[:i])
-
-                    model_qs = Model.objects.filter(
-                        Q(name__icontains=potential_model_name),
-                        manufacturer__name__icontains=manufacturer_name,
+        response = yield Request(url)
+
+        if response.status_code != 200:
+            raise ScrapeError(
+                f"Failed to fetch variations for {year} {manufacturer_name}."
+            )
+
+        # Parsed here so the save step, on the database thread, only matches
+        return list(iter_menu_items(response, "text"))
+
+    def save_variations(self, year, manufacturer_name, full_model_names):
+        # Load the manufacturer's models once and match every menu item in memory
+        index = ModelIndex(
+            (model.id, model.name, model.full_name)
+            for model in Model.objects.filter(
+                manufacturer__name__icontains=manufacturer_name
+            ).select_related("manufacturer")
+        )
+
+        matches = []
+        for full_model_name in full_model_names:
+            match = index.match(full_model_name)
+            if match:
+                matches.append(match)
+            else:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"No matching model found for '{full_model_name}'."
                     )
+                )
 
-                    if model_qs.exists():
-                        # If a matching model is found, determine the variation name
-                        variation_name = (
-                            " ".join(parts[i:]) if i < len(parts) else "Base"
-                        )
-                        model_instance = model_qs.first()
-
-                        model_instance_years = ModelYear.objects.filter(
-                            model=model_instance, year=year
-                        )
-                        if not model_instance_years.exists():
-                            model_instance_year = ModelYear.objects.create(
-                                model=model_instance, year=year
-                            )
-                            self.stdout.write(
-                                f"Added model year '{year}' to model '{model_instance}'."
-                            )
-                        else:
-                            model_instance_year = model_instance_years.first()
-
-                        # Create a new variation for the model
-                        _, created = Variation.objects.get_or_create(
-                            model_year=model_instance_year, name=variation_name
-                        )
-                        if created:
-                            self.stdout.write(
-                                self.style.SUCCESS(
-                                    f"Added variation '{variation_name}' to model '{model_instance_year}'."
-                                )
-                            )
-                        else:
-                            self.stdout.write(
-                                self.style.WARNING(
-                                    f"Existing variation '{variation_name}' for model '{model_instance_year}'."
-                                )
-                            )
-                        break  # Break the loop once the matching model is found and variation created
-                    else:
-                        # If no matching model is found after checking all combinations
-                        self.stdout.write(
-                            self.style.WARNING(
-                                f"No matching model found for '{full_model_name}'."
-                            )
-                        )
-        else:
+        model_years, created_model_years = bulk_get_or_create(
+            ModelYear,
+            ("model_id", "year"),
+            [(model_id, year) for model_id, _ in matches],
+        )
+        for model_id, _ in sorted(created_model_years):
             self.stdout.write(
-                f"Failed to fetch variations for {year} {manufacturer_name}."
+                f"Added model year '{year}' to model '{index.labels[model_id]}'."
             )
 
+        variations, created_variations = bulk_get_or_create(
+            Variation,
+            ("model_year_id", "name"),
+            [
+                (model_years[(model_id, year)].id, variation_name)
+                for model_id, variation_name in matches
+            ],
+        )
+        self.touch("pk", [variations[key].pk for key in created_variations])
+        self.count_rows("model_year", created=len(created_model_years))
+        self.count_rows("variation", created=len(created_variations))
+        for model_id, variation_name in matches:
+            model_year = model_years[(model_id, year)]
+            model_year_name = f"{year} {index.labels[model_id]}"
+            if (model_year.id, variation_name) in created_variations:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Added variation '{variation_name}' to model '{model_year_name}'."
+                    )
+                )
+            else:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"Existing variation '{variation_name}' for model '{model_year_name}'."
+                    )
+                )
+
 
 Command = ScrapeCarDataCommand
@@ -1,47 +1,54 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from ..base_scrape import BaseAPICommand
-import requests
+import threading
+
+from django.db import connection, transaction
+from ..base_scrape import BaseAPICommand, Request, ScrapeError
+from carcomparer.cars.bulk import bulk_get_or_create, get_or_create_manufacturers
 from carcomparer.cars.models import *
 
 
 class ScrapeCarDataCommand(BaseAPICommand):  # Inherits from BaseAPICommand
     help = "Scrapes NHTSA to populate the database with up-to-date model information"
+    rate_limits = {"vpic.nhtsa.dot.gov": 10}
 
-    def scrape_models(self, year):
-        manufacturers = Manufacturer.objects.all()
+    def handle(self, *args, **kwargs):
+        # VehicleType ids by name for the whole run, it is a short reference table
+        self.vehicle_types = dict(VehicleType.objects.values_list("name", "id"))
+        self.vehicle_types_lock = threading.Lock()
+        super().handle(*args, **kwargs)
 
-        # Use ThreadPoolExecutor to parallelize requests
-        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
-            futures = [
-                executor.submit(
-                    self.scrape_models_for_manufacturer, year, manufacturer.name
-                )
-                for manufacturer in manufacturers
-            ]
-            for future in futures:
-                future.result()  # Wait for all futures to complete
+    def models_units(self, year):
+        return Manufacturer.objects.values_list("name", flat=True)
 
-    def scrape_models_for_manufacturer(self, year, manufacturer_name):
+    def fetch_models(self, year, manufacturer_name):
         url = f"https://vpic.nhtsa.dot.gov/api/vehicles/getmodelsformakeyear/make/{manufacturer_name}/modelyear/{year}?format=json"
-        response = requests.get(url)
+        response = yield Request(url)
         if response.status_code != 200:
-            self.stdout.write(
-                self.style.ERROR(
-                    f"Error accessing the NHTSA API for {manufacturer_name}"
-                )
-            )
-            return
+            raise ScrapeError(f"Error accessing the NHTSA API for {manufacturer_name}")
+
+        return response.json()
 
-        data = response.json()
+    def save_models(self, year, manufacturer_name, data):
         if data["Count"] > 0:
-            manufacturer, _ = Manufacturer.objects.get_or_create(name=manufacturer_name)
-            for model in data["Results"]:
-                model_name = model["Model_Name"]
-                car_model, created = Model.objects.get_or_create(
-                    manufacturer=manufacturer,
-                    name=model_name,
-                )
-                if created:
+            manufacturers, _ = get_or_create_manufacturers([manufacturer_name])
+            manufacturer = manufacturers[manufacturer_name]
+            model_names = {model["Model_Name"] for model in data["Results"]}
+
+            # The whole manufacturer is written in one batch, see bulk_get_or_create
+            car_models, created_models = bulk_get_or_create(
+                Model,
+                ("manufacturer_id", "name"),
+                [(manufacturer.id, model_name) for model_name in model_names],
+            )
+            _, created_model_years = bulk_get_or_create(
+                ModelYear,
+                ("model_id", "year"),
+                [(car_model.id, year) for car_model in car_models.values()],
+            )
+            self.count_rows("model", created=len(created_models))
+            self.count_rows("model_year", created=len(created_model_years))
+
+            for (_, model_name), car_model in sorted(car_models.items()):
+                if (manufacturer.id, model_name) in created_models:
                     self.stdout.write(
                         self.style.SUCCESS(
                             f"Added model: {manufacturer_name} {model_name}"
@@ -53,10 +60,7 @@ class ScrapeCarDataCommand(BaseAPICommand):  # Inherits from BaseAPICommand
                             f"Existing model: {manufacturer_name} {model_name}"
                         )
                     )
-                car_model_year, created = ModelYear.objects.get_or_create(
-                    model=car_model, year=year
-                )
-                if created:
+                if (car_model.id, year) in created_model_years:
                     self.stdout.write(
                         self.style.SUCCESS(
                             f"Added model year: {year} {manufacturer_name} {model_name}"
@@ -69,76 +73,101 @@ class ScrapeCarDataCommand(BaseAPICommand):  # Inherits from BaseAPICommand
                         )
                     )
 
-    def scrape_vehicle_types(self, year):
-        manufacturers = Manufacturer.objects.all()
-
-        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
-            future_to_manufacturer = {
-                executor.submit(
-                    self.update_all_vehicle_types, manufacturer, year
-                ): manufacturer
-                for manufacturer in manufacturers
-            }
-            for future in as_completed(future_to_manufacturer):
-                manufacturer = future_to_manufacturer[future]
-                try:
-                    future.result()
-                except Exception as exc:
-                    self.stdout.write(
-                        self.style.ERROR(
-                            f"{manufacturer.name} generated an exception: {exc}"
-                        )
-                    )
-
-    def update_all_vehicle_types(self, manufacturer, year):
-        vehicle_types = self.fetch_vehicle_types_for_manufacturer(manufacturer.name)
-        for vehicle_type_name in vehicle_types:
-            self.update_vehicle_types(manufacturer, year, vehicle_type_name)
+    def vehicle_types_units(self, year):
+        return Manufacturer.objects.values_list("name", flat=True)
 
-    def fetch_vehicle_types_for_manufacturer(self, manufacturer_name):
+    def fetch_vehicle_types(self, year, manufacturer_name):
+        """Returns {vehicle type name: model names, or None if the lookup failed}"""
+        vehicle_types = {}
         url = f"https://vpic.nhtsa.dot.gov/api/vehicles/GetVehicleTypesForMake/{manufacturer_name}?format=json"
-        response = requests.get(url)
-        vehicle_types = []
+        response = yield Request(url)
         if response.status_code == 200:
-            data = response.json()
-            for item in data.get("Results", []):
-                vehicle_type_name = item["VehicleTypeName"]
-                VehicleType.objects.get_or_create(name=vehicle_type_name)
-                vehicle_types.append(vehicle_type_name)
+            for item in response.json().get("Results", []):
+                vehicle_types[item["VehicleTypeName"]] = None
+
+        for vehicle_type_name in vehicle_types:
+            url = f"https://vpic.nhtsa.dot.gov/api/vehicles/getmodelsformakeyear/make/{manufacturer_name}/modelyear/{year}/vehicleType/{vehicle_type_name}?format=json"
+            response = yield Request(url)
+            if response.status_code == 200:
+                vehicle_types[vehicle_type_name] = [
+                    item["Model_Name"] for item in response.json().get("Results", [])
+                ]
 
         return vehicle_types
 
-    def update_vehicle_types(self, manufacturer, year, vehicle_type_name):
-        url = f"https://vpic.nhtsa.dot.gov/api/vehicles/getmodelsformakeyear/make/{manufacturer.name}/modelyear/{year}/vehicleType/{vehicle_type_name}?format=json"
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            # Get or create the VehicleType object outside the loop.
-            vehicle_type, _ = VehicleType.objects.get_or_create(name=vehicle_type_name)
-            updated_models_count = 0  # To keep track of how many models were updated.
-            for item in data.get("Results", []):
-                model_name = item["Model_Name"]
-                # Try to update the vehicle_type for existing models.
-                updated = Model.objects.filter(
-                    manufacturer=manufacturer, name=model_name
-                ).update(vehicle_type=vehicle_type)
-                if updated:
-                    updated_models_count += 1
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f"Updated vehicle type for: {manufacturer.name} {model_name} to {vehicle_type_name}"
-                        )
+    def save_vehicle_types(self, year, manufacturer_name, vehicle_types):
+        # A model listed under several types ends up with the last one
+        assignments = {
+            model_name: vehicle_type_name
+            for vehicle_type_name, model_names in vehicle_types.items()
+            if model_names is not None
+            for model_name in model_names
+        }
+        type_ids = self.get_vehicle_type_ids(vehicle_types)
+        self.update_vehicle_types(manufacturer_name, assignments, type_ids)
+        self.touch("model_year__model__manufacturer__name", [manufacturer_name])
+
+    def get_vehicle_type_ids(self, names):
+        """{name: VehicleType id}, only querying for types not seen yet"""
+        with self.vehicle_types_lock:
+            known = {
+                name: self.vehicle_types[name]
+                for name in names
+                if name in self.vehicle_types
+            }
+        missing = set(names) - known.keys()
+        if missing:
+            created, _ = bulk_get_or_create(
+                VehicleType, ("name",), [(name,) for name in missing]
+            )
+            ids = {name: vehicle_type.id for (name,), vehicle_type in created.items()}
+            known.update(ids)
+            # Only cache ids whose rows survive this unit's transaction
+            transaction.on_commit(lambda: self.cache_vehicle_types(ids))
+        return known
+
+    def cache_vehicle_types(self, ids):
+        with self.vehicle_types_lock:
+            self.vehicle_types.update(ids)
+
+    def update_vehicle_types(self, manufacturer_name, assignments, type_ids):
+        """
+        Set the vehicle type of the manufacturer's models in one statement.
+
+        ``assignments`` maps model names to vehicle type names.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE cars_model m SET vehicle_type_id = t.vehicle_type_id
+                FROM unnest(%s::text[], %s::bigint[]) AS t(name, vehicle_type_id),
+                     cars_manufacturer mf
+                WHERE m.manufacturer_id = mf.id AND mf.name = %s AND m.name = t.name
+                RETURNING m.name
+                """,
+                [
+                    list(assignments),
+                    [type_ids[name] for name in assignments.values()],
+                    manufacturer_name,
+                ],
+            )
+            updated = {row[0] for row in cursor.fetchall()}
+
+        for model_name, vehicle_type_name in sorted(assignments.items()):
+            if model_name in updated:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Updated vehicle type for: {manufacturer_name} {model_name} to {vehicle_type_name}"
                     )
-                else:
-                    # Optional: Log if a model was expected but not found.
-                    self.stdout.write(
-                        self.style.WARNING(
-                            f"No existing model found to update: {manufacturer.name} {model_name}"
-                        )
+                )
+            else:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"No existing model found to update: {manufacturer_name} {model_name}"
                     )
-            self.stdout.write(
-                self.style.SUCCESS(f"Total models updated: {updated_models_count}")
-            )
+                )
+        self.count_rows("model", updated=len(updated))
+        self.stdout.write(self.style.SUCCESS(f"Total models updated: {len(updated)}"))
 
 
 # This ensures Django finds this as the command to run
@@ -1,92 +1,248 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from ..base_scrape import BaseAPICommand
-import requests
+from ..base_scrape import DAY, BaseAPICommand, Request
+from ..parsing import Parse, parse_article
 from carcomparer.cars.models import *
-from bs4 import BeautifulSoup
-from django.utils.dateparse import parse_date
 from dateutil.parser import parse as parse_dateutil
+from datetime import date
 import re
 
+WIKIPEDIA_API = "https://en.wikipedia.org/w/api.php"
+WIKIDATA_API = "https://www.wikidata.org/w/api.php"
+
+# Most titles or ids the MediaWiki APIs accept in one request
+BATCH_SIZE = 50
+
 
 class ScrapeCarDataCommand(BaseAPICommand):  # Inherits from BaseAPICommand
     help = (
         "Scrapes Wikipedia to populate the database with up-to-date model information"
     )
+    # Manufacturer pages do not depend on the year being scraped
+    cache_ttl = 7 * DAY
+    historical_cache_ttl = 7 * DAY
+    rate_limits = {"en.wikipedia.org": 20, "www.wikidata.org": 20}
+
+    def manufacturers_units(self, year):
+        names = sorted(Manufacturer.objects.values_list("name", flat=True))
+        return [
+            tuple(names[i : i + BATCH_SIZE]) for i in range(0, len(names), BATCH_SIZE)
+        ]
+
+    def unit_key(self, unit):
+        # Batches are cut from the sorted names, so the first one identifies it
+        return f"{unit[0]} +{len(unit) - 1}"
+
+    def fetch_manufacturers(self, year, manufacturer_names):
+        """Returns {manufacturer name: info dict, or None if nothing was found}"""
+        pages = yield from self.query_pages(manufacturer_names)
+        items = [page["wikibase_item"] for page in pages.values() if page]
+        entities = yield from self.get_entities(items, "claims")
+
+        info = {}
+        countries = set()
+        for name in manufacturer_names:
+            page = pages[name]
+            if page is None:
+                continue
+            claims = entities.get(page["wikibase_item"], {}).get("claims", {})
+            country = self.claim_value(claims, "P17")
+            if country:
+                countries.add(country["id"])
+            founded = self.claim_value(claims, "P571")
+            info[name] = {
+                "description": self.get_extract_description(page["extract"]),
+                "founded_date": self.parse_wikidata_time(founded),
+                "country": country["id"] if country else None,
+                "website": self.claim_value(claims, "P856"),
+            }
+
+        labels = yield from self.get_entities(sorted(countries), "labels")
+        for data in info.values():
+            if data["country"]:
+                label = labels.get(data["country"], {}).get("labels", {}).get("en")
+                data["country"] = label["value"] if label else None
+
+        # Names without an unambiguous article go through search and the HTML page
+        for name in manufacturer_names:
+            if name not in info:
+                info[name] = yield from self.scrape_page(name)
+        return info
+
+    def query_pages(self, titles):
+        """
+        Resolve up to 50 titles in one query, following redirects.
+
+        Returns {title: {"title", "wikibase_item", "extract"}}, None for titles
+        that are missing, disambiguation pages or not linked to Wikidata.
+        """
+        params = {
+            "action": "query",
+            "format": "json",
+            "formatversion": 2,
+            "titles": "|".join(titles),
+            "redirects": 1,
+            "prop": "extracts|pageprops",
+            "exintro": 1,
+            "explaintext": 1,
+            "exlimit": "max",
+            "ppprop": "disambiguation|wikibase_item",
+        }
+        pages, renames = {}, {}
+        while True:
+            response = (yield Request(WIKIPEDIA_API, params=params)).json()
+            query = response.get("query", {})
+            for rename in query.get("normalized", []) + query.get("redirects", []):
+                renames[rename["from"]] = rename["to"]
+            for page in query.get("pages", []):
+                merged = pages.setdefault(page["title"], {})
+                merged.update(page)
+                merged["pageprops"] = {
+                    **merged.get("pageprops", {}),
+                    **page.get("pageprops", {}),
+                }
+            # Extracts come back in slices, the rest arrives on continuation
+            if "continue" not in response:
+                break
+            params = {**params, **response["continue"]}
+
+        resolved = {}
+        for title in titles:
+            target = title
+            while target in renames:
+                target = renames[target]
+            page = pages.get(target, {})
+            props = page.get("pageprops", {})
+            if (
+                page.get("missing")
+                or "disambiguation" in props
+                or not props.get("wikibase_item")
+            ):
+                resolved[title] = None
+            else:
+                resolved[title] = {
+                    "title": page["title"],
+                    "wikibase_item": props["wikibase_item"],
+                    "extract": page.get("extract", ""),
+                }
+        return resolved
+
+    def get_entities(self, ids, props):
+        """Wikidata entities by id, in requests of up to 50"""
+        entities = {}
+        for i in range(0, len(ids), BATCH_SIZE):
+            params = {
+                "action": "wbgetentities",
+                "format": "json",
+                "ids": "|".join(ids[i : i + BATCH_SIZE]),
+                "props": props,
+                "languages": "en",
+            }
+            response = yield Request(WIKIDATA_API, params=params)
+            entities.update(response.json().get("entities", {}))
+        return entities
+
+    def claim_value(self, claims, prop):
+        """Value of the first usable statement for ``prop``"""
+        for claim in claims.get(prop, []):
+            value = claim.get("mainsnak", {}).get("datavalue", {}).get("value")
+            if claim.get("rank") != "deprecated" and value:
+                return value
+        return None
 
-    def scrape_manufacturers(self, year):
-        manufacturers = Manufacturer.objects.all()
+    def parse_wikidata_time(self, value):
+        """Wikidata times look like +1937-08-28T00:00:00Z, with 00 for unknown parts"""
+        match = (
+            re.match(r"^\+(\d{4})-(\d{2})-(\d{2})", value["time"]) if value else None
+        )
+        if not match:
+            return None
+        year, month, day = (int(part) for part in match.groups())
+        return date(year, month or 1, day or 1)
 
-        # Use ThreadPoolExecutor to parallelize requests
-        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
-            futures = [
-                executor.submit(self.scrape_manufacturer_info, manufacturer.name)
-                for manufacturer in manufacturers
-            ]
-            for future in futures:
-                future.result()
+    def get_extract_description(self, extract):
+        """First paragraph of the plain text lead section"""
+        for paragraph in extract.split("\n"):
+            if paragraph.strip():
+                return self.clean_text(paragraph)
+        return "Description not found."
 
-    def scrape_manufacturer_info(self, manufacturer_name):
-        page_url = self.search_wikipedia_for_page(manufacturer_name)
+    def scrape_page(self, manufacturer_name):
+        """Search for the manufacturer's article and read its rendered infobox"""
+        page_url = yield from self.search_wikipedia_for_page(manufacturer_name)
         if not page_url:
-            self.stdout.write(
-                self.style.ERROR(
-                    f"Error Scraping {manufacturer_name}, Could not find Wikipedia Page"
-                )
-            )
+            return None
 
-        try:
-            response = requests.get(page_url)
-            soup = BeautifulSoup(response.text, "html.parser")
-            description = self.get_description(soup)
-            infobox = soup.find("table", {"class": "infobox"})
-            year, country, website = None, None, None
-            if infobox:
-                for row in infobox.find_all("tr"):
-                    header = row.find("th")
-                    data = row.find("td")
-                    if header and data:
-                        header_text = header.text.strip().lower()
-                        data_text = data.text.strip()
-                        if "founded" in header_text:
-                            year = data_text.split(";")[0].strip()
-                        elif "headquarters" in header_text:
-                            country = data_text.split(",")[-1].strip()
-                        elif "website" in header_text:
-                            website_link = data.find("a", href=True)
-                            if website_link:
-                                website = website_link["href"]
-
-                # Try to get the specific manufacturer by name
-                manufacturer = Manufacturer.objects.get(name=manufacturer_name)
-                year = self.extract_and_parse_date(year)
-
-                # Update the fields
-                manufacturer.country = (
-                    self.clean_text(country)
-                    if country is not None
-                    else manufacturer.country
-                )
-                manufacturer.founded_date = year if year else manufacturer.founded_date
-                manufacturer.description = (
-                    description if description is not None else manufacturer.description
-                )
-                manufacturer.website = (
-                    website if website is not None else manufacturer.website
-                )
+        response = yield Request(page_url)
+        article = yield Parse(parse_article, response.text)
+        if not article:
+            return None
 
-                # Save the changes
-                manufacturer.save()
+        description = article["description"]
+        founded = article["founded"]
+        country = article["headquarters"]
+        return {
+            "description": (
+                self.clean_text(description)
+                if description is not None
+                else "Description not found."
+            ),
+            "founded_date": (
+                self.extract_and_parse_date(founded.split(";")[0].strip())
+                if founded is not None
+                else None
+            ),
+            "country": (
+                self.clean_text(country.split(",")[-1].strip())
+                if country is not None
+                else None
+            ),
+            "website": article["website"],
+        }
 
+    def save_manufacturers(self, year, manufacturer_names, infos):
+        manufacturers = Manufacturer.objects.filter(name__in=manufacturer_names)
+        updated = []
+        for manufacturer in manufacturers:
+            info = infos.get(manufacturer.name)
+            if not info:
+                # Fetch steps can run on the event loop, so misses are reported here
                 self.stdout.write(
-                    self.style.SUCCESS(
-                        f"Updated {manufacturer_name} information successfully. {manufacturer.founded_date}"
+                    self.style.ERROR(
+                        f"Error Scraping {manufacturer.name}, Could not find Wikipedia Page"
                     )
                 )
-        except Exception as e:
+                continue
+
+            # Update the fields
+            manufacturer.country = (
+                info["country"] if info["country"] is not None else manufacturer.country
+            )
+            manufacturer.founded_date = (
+                info["founded_date"]
+                if info["founded_date"]
+                else manufacturer.founded_date
+            )
+            manufacturer.description = (
+                info["description"]
+                if info["description"] is not None
+                else manufacturer.description
+            )
+            manufacturer.website = (
+                info["website"] if info["website"] is not None else manufacturer.website
+            )
+            updated.append(manufacturer)
+
             self.stdout.write(
-                self.style.ERROR(f"Error Scraping {manufacturer_name}, {str(e)}")
+                self.style.SUCCESS(
+                    f"Updated {manufacturer.name} information successfully. {manufacturer.founded_date}"
+                )
             )
 
+        # Save the changes of the whole batch in one query
+        Manufacturer.objects.bulk_update(
+            updated, ["country", "founded_date", "description", "website"]
+        )
+        self.count_rows("manufacturer", updated=len(updated))
+
     def search_wikipedia_for_page(self, title):
         """Use Wikipedia's API to search for a page and handle redirections and disambiguation."""
         params = {
@@ -97,8 +253,7 @@ class ScrapeCarDataCommand(BaseAPICommand):  # Inherits from BaseAPICommand
             "utf8": 1,
             "srlimit": 1,
         }
-        api_url = "https://en.wikipedia.org/w/api.php"
-        response = requests.get(api_url, params=params).json()
+        response = (yield Request(WIKIPEDIA_API, params=params)).json()
 
         search_results = response.get("query", {}).get("search", [])
         if search_results:
@@ -113,14 +268,6 @@ class ScrapeCarDataCommand(BaseAPICommand):  # Inherits from BaseAPICommand
         """
         return re.sub(r"\[.*?\]|\(.*?\)", "", text).strip()
 
-    def get_description(self, soup):
-        """Extract and clean the description from the soup object."""
-        for p in soup.find_all("p"):
-            if p.find("b"):
-                cleaned_text = self.clean_text(p.text)
-                return cleaned_text
-        return "Description not found."
-
     def extract_and_parse_date(self, date_string):
         # Try to find a date-like substring (e.g., "October 1946" or "1946-10")
         # This regex looks for patterns like "October 1946", "1946-10", or "24 September 1948"
@@ -138,7 +285,7 @@ class ScrapeCarDataCommand(BaseAPICommand):  # Inherits from BaseAPICommand
                 return None
         else:
             # No date-like substring was found
-            return "None"
+            return None
 
 
 Command = ScrapeCarDataCommand
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from .http_client import Response
+
+
+class CacheEntry:
+    def __init__(self, path, meta, content):
+        self.path = path
+        self.meta = meta
+        self.response = Response(
+            meta["url"], meta["status_code"], content, meta["headers"]
+        )
+
+    def is_fresh(self, ttl):
+        return ttl is None or time.time() - self.meta["stored_at"] < ttl
+
+    def validators(self):
+        """Conditional request headers to revalidate a stale entry"""
+        headers = {}
+        if "ETag" in self.response.headers:
+            headers["If-None-Match"] = self.response.headers["ETag"]
+        if "Last-Modified" in self.response.headers:
+            headers["If-Modified-Since"] = self.response.headers["Last-Modified"]
+        return headers
+
+
+class ResponseCache:
+    """
+    On-disk cache of successful API responses keyed by url and params.
+
+    Each entry is one file: a JSON header line followed by the raw body.
+    Entries older than the request's TTL are revalidated with ETag /
+    Last-Modified when the API gave us one. File mtimes double as the LRU
+    clock, the oldest entries are evicted once the directory grows past
+    ``max_size`` bytes.
+
+    Every method blocks on file I/O, ``AsyncHttpClient`` calls them on a
+    worker thread through ``asyncio.to_thread``.
+    """
+
+    # Headers worth keeping, the rest are connection details
+    KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+    def __init__(self, directory, max_size=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _path(self, request):
+        key = request.url
+        if request.params:
+            key += "?" + urlencode(sorted(request.params.items()))
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, request):
+        path = self._path(request)
+        try:
+            with open(path, "rb") as f:
+                meta = json.loads(f.readline())
+                content = f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        # Bump the mtime so eviction drops least recently used entries first
+        os.utime(path)
+        return CacheEntry(path, meta, content)
+
+    def store(self, request, response, entry=None):
+        """
+        Record ``response`` for ``request`` and return the response to use.
+
+        A 304 for a revalidated ``entry`` renews it and returns the cached body.
+        """
+        if response.status_code == 304 and entry is not None:
+            self._write(entry.path, entry.response)
+            return entry.response
+        if response.status_code == 200:
+            self._write(self._path(request), response)
+        return response
+
+    def _write(self, path, response):
+        meta = {
+            "url": response.url,
+            "status_code": response.status_code,
+            "headers": {
+                name: response.headers[name]
+                for name in self.KEPT_HEADERS
+                if name in response.headers
+            },
+            "stored_at": time.time(),
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so readers never see half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(json.dumps(meta).encode() + b"\n")
+            f.write(response.content)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.size += os.path.getsize(path) - old_size
+            if self.size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        # Trim to 90% so we are not evicting again on the very next write
+        target = self.max_size * 0.9
+        for path, size, _ in sorted(self._entries(), key=lambda entry: entry[2]):
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.size -= size
@@ -0,0 +1,247 @@
+import asyncio
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from .metrics import ScrapeMetrics
+from .rate_limit import RateLimiter, RetryPolicy
+
+# Statuses that mean the host wants us to slow down
+THROTTLE_STATUSES = {429, 503}
+
+# (connect, read) timeouts in seconds used when a command does not override them
+DEFAULT_TIMEOUT = (5.0, 30.0)
+
+
+class Request:
+    """
+    A GET request yielded by a scrape unit to whichever engine is running it.
+
+    ``ttl`` is how many seconds a cached response stays fresh, None lets the
+    command decide.
+    """
+
+    def __init__(self, url, params=None, headers=None, ttl=None):
+        self.url = url
+        self.params = params
+        self.headers = headers
+        self.ttl = ttl
+
+    def __repr__(self):
+        return f"<Request {self.url}>"
+
+
+class Response:
+    """Fully read HTTP response, the same shape for both the thread and async engines"""
+
+    def __init__(self, url, status_code, content, headers=None):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = CaseInsensitiveDict(headers or {})
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size):
+        """The body in ``chunk_size`` byte slices, without copying it"""
+        body = memoryview(self.content)
+        for start in range(0, len(body), chunk_size):
+            yield body[start : start + chunk_size]
+
+    def __repr__(self):
+        return f"<Response [{self.status_code}] {self.url}>"
+
+
+class HttpClient:
+    """
+    HTTP client shared by every worker of a scrape command.
+
+    All threads share one ``HTTPAdapter`` so keep-alive connections are pooled
+    per host and reused across requests. ``requests.Session`` itself is not
+    thread-safe, so each thread gets its own lightweight session mounted on the
+    shared adapter.
+    """
+
+    def __init__(
+        self,
+        pool_size=10,
+        timeout=DEFAULT_TIMEOUT,
+        headers=None,
+        cache=None,
+        limiter=None,
+        retry=None,
+        metrics=None,
+        sleep=time.sleep,
+    ):
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.cache = cache
+        self.limiter = limiter or RateLimiter()
+        self.retry = retry or RetryPolicy()
+        self.metrics = metrics or ScrapeMetrics()
+        self.sleep = sleep
+        # pool_block keeps us at pool_size open sockets per host instead of
+        # opening throwaway connections when every worker is busy
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True
+        )
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            session.mount("https://", self.adapter)
+            session.mount("http://", self.adapter)
+            self._local.session = session
+        return session
+
+    def fetch(self, request):
+        host = urlsplit(request.url).hostname
+        entry = self.cache.get(request) if self.cache else None
+        if entry and entry.is_fresh(request.ttl):
+            self.metrics.cache_hit(host)
+            return entry.response
+
+        headers = {**(request.headers or {}), **(entry.validators() if entry else {})}
+        bucket = self.limiter.bucket(request.url)
+        attempt = 0
+        while True:
+            wait = bucket.reserve()
+            self.metrics.waited(host, wait)
+            self.sleep(wait)
+            start = time.perf_counter()
+            try:
+                response = self.get(request, headers)
+            except requests.RequestException:
+                self.metrics.request(host, "error", time.perf_counter() - start)
+                if not self.retry.should_retry(attempt):
+                    raise
+                response = None
+            else:
+                self.metrics.request(
+                    host, response.status_code, time.perf_counter() - start
+                )
+                if not self.retry.should_retry(attempt, response):
+                    break
+            delay = self.retry.delay(attempt, response)
+            if response is not None and response.status_code in THROTTLE_STATUSES:
+                bucket.throttled(delay)
+            self.sleep(delay)
+            attempt += 1
+
+        if response.status_code not in THROTTLE_STATUSES:
+            bucket.succeeded()
+        return self.cache.store(request, response, entry) if self.cache else response
+
+    def get(self, request, headers):
+        response = self.session.get(
+            request.url,
+            params=request.params,
+            headers=headers,
+            timeout=self.timeout,
+        )
+        return Response(
+            response.url, response.status_code, response.content, response.headers
+        )
+
+    def close(self):
+        self.adapter.close()
+
+
+class AsyncHttpClient:
+    """aiohttp counterpart of ``HttpClient`` used by the async engine"""
+
+    def __init__(
+        self,
+        limit=100,
+        timeout=DEFAULT_TIMEOUT,
+        headers=None,
+        cache=None,
+        limiter=None,
+        retry=None,
+        metrics=None,
+    ):
+        self.limit = limit
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.cache = cache
+        self.limiter = limiter or RateLimiter()
+        self.retry = retry or RetryPolicy()
+        self.metrics = metrics or ScrapeMetrics()
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.limit),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=self.timeout[0], sock_read=self.timeout[1]
+            ),
+            headers=self.headers,
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def fetch(self, request):
+        host = urlsplit(request.url).hostname
+        # The cache reads and writes files, keep that off the event loop
+        entry = await asyncio.to_thread(self.cache.get, request) if self.cache else None
+        if entry and entry.is_fresh(request.ttl):
+            self.metrics.cache_hit(host)
+            return entry.response
+
+        headers = {**(request.headers or {}), **(entry.validators() if entry else {})}
+        bucket = self.limiter.bucket(request.url)
+        attempt = 0
+        while True:
+            wait = bucket.reserve()
+            self.metrics.waited(host, wait)
+            await asyncio.sleep(wait)
+            start = time.perf_counter()
+            try:
+                response = await self.get(request, headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.metrics.request(host, "error", time.perf_counter() - start)
+                if not self.retry.should_retry(attempt):
+                    raise
+                response = None
+            else:
+                self.metrics.request(
+                    host, response.status_code, time.perf_counter() - start
+                )
+                if not self.retry.should_retry(attempt, response):
+                    break
+            delay = self.retry.delay(attempt, response)
+            if response is not None and response.status_code in THROTTLE_STATUSES:
+                bucket.throttled(delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        if response.status_code not in THROTTLE_STATUSES:
+            bucket.succeeded()
+        if self.cache:
+            return await asyncio.to_thread(self.cache.store, request, response, entry)
+        return response
+
+    async def get(self, request, headers):
+        async with self.session.get(
+            request.url, params=request.params, headers=headers
+        ) as response:
+            content = await response.read()
+            return Response(
+                str(response.url), response.status, content, response.headers
+            )
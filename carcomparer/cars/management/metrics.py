@@ -0,0 +1,320 @@
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+class QueryCounter:
+    """
+    Counts the queries, and the time spent in them, of every thread.
+
+    Each thread has its own database connection, so the counter hooks into
+    the ones already open and into every connection opened while it is
+    installed.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.count += 1
+                self.time += elapsed
+
+    def attach(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        for connection in connections.all(initialized_only=True):
+            self.attach(connection=connection)
+        connection_created.connect(self.attach)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self.attach)
+        for connection in connections.all(initialized_only=True):
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+# Upper bounds in seconds of the latency and phase histograms
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Where a unit spends its time, see UnitTimer
+PHASES = ("network", "parse", "save")
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the ``q`` quantile"""
+        if not self.count:
+            return None
+        target = q * self.count
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= target:
+                return bound
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "mean": round(self.sum / self.count, 4) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": round(self.max, 4),
+        }
+
+
+class UnitTimer:
+    """Time one unit of work spends waiting on the network, parsing and saving"""
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.queries = QueryCounter()
+
+    @contextmanager
+    def measure(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[phase] += time.perf_counter() - start
+
+
+class ScrapeMetrics:
+    """
+    Counters for one scrape run, shared by every worker.
+
+    The HTTP clients report each request, ``BaseAPICommand`` reports units,
+    queue depth and the rows its save steps write. ``prometheus()`` and
+    ``summary()`` export everything at the end of the run.
+    """
+
+    def __init__(self, **labels):
+        # e.g. command and scrape_type, added to every exported sample
+        self.labels = labels
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.latency = defaultdict(lambda: Histogram(SECONDS_BUCKETS))
+        self.statuses = Counter()
+        self.cache_hits = Counter()
+        self.rate_limit_wait = Counter()
+        self.phases = {phase: Histogram(SECONDS_BUCKETS) for phase in PHASES}
+        self.unit_queries = Histogram(QUERY_BUCKETS)
+        self.query_seconds = 0.0
+        self.units = Counter()
+        self.queues = Counter()
+        self.queue_max = Counter()
+        self.rows = Counter()
+
+    def request(self, host, status, seconds):
+        """``status`` is the HTTP status or "error" when no response came back"""
+        with self.lock:
+            self.latency[host].observe(seconds)
+            self.statuses[host, str(status)] += 1
+
+    def cache_hit(self, host):
+        with self.lock:
+            self.cache_hits[host] += 1
+
+    def waited(self, host, seconds):
+        if seconds > 0:
+            with self.lock:
+                self.rate_limit_wait[host] += seconds
+
+    def queue(self, name, change):
+        with self.lock:
+            self.queues[name] += change
+            self.queue_max[name] = max(self.queue_max[name], self.queues[name])
+
+    def unit_done(self, timer):
+        with self.lock:
+            self.units["done"] += 1
+            for phase, seconds in timer.seconds.items():
+                self.phases[phase].observe(seconds)
+            self.unit_queries.observe(timer.queries.count)
+            self.query_seconds += timer.queries.time
+
+    def unit_failed(self):
+        with self.lock:
+            self.units["failed"] += 1
+
+    def count_rows(self, table, created=0, updated=0):
+        with self.lock:
+            self.rows[table, "created"] += created
+            self.rows[table, "updated"] += updated
+
+    @property
+    def bottleneck(self):
+        """The phase units spent most of their time in"""
+        totals = {phase: self.phases[phase].sum for phase in PHASES}
+        return max(totals, key=totals.get) if any(totals.values()) else None
+
+    def summary(self):
+        with self.lock:
+            return {
+                **self.labels,
+                "seconds": round(time.perf_counter() - self.started, 3),
+                "bottleneck": self.bottleneck,
+                "units": dict(self.units),
+                "hosts": {
+                    host: {
+                        "latency": self.latency[host].summary(),
+                        "statuses": {
+                            status: count
+                            for (h, status), count in self.statuses.items()
+                            if h == host
+                        },
+                        "cache_hits": self.cache_hits[host],
+                        "rate_limit_wait": round(self.rate_limit_wait[host], 3),
+                    }
+                    for host in sorted({*self.latency, *self.cache_hits})
+                },
+                "phases": {
+                    phase: histogram.summary()
+                    for phase, histogram in self.phases.items()
+                },
+                "queries_per_unit": self.unit_queries.summary(),
+                "query_seconds": round(self.query_seconds, 3),
+                "max_queue_depth": dict(self.queue_max),
+                "rows": {
+                    f"{table}.{action}": count
+                    for (table, action), count in self.rows.items()
+                    if count
+                },
+            }
+
+    def prometheus(self):
+        """Prometheus text exposition format"""
+        lines = []
+
+        def metric(name, kind, description, samples):
+            lines.append(f"# HELP scrape_{name} {description}")
+            lines.append(f"# TYPE scrape_{name} {kind}")
+            for suffix, labels, value in samples:
+                labels = {**self.labels, **labels}
+                text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"scrape_{name}{suffix}{{{text}}} {value}")
+
+        def histogram(labels, histogram):
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                yield "_bucket", {**labels, "le": bound}, count
+            yield "_bucket", {**labels, "le": "+Inf"}, histogram.count
+            yield "_sum", labels, round(histogram.sum, 6)
+            yield "_count", labels, histogram.count
+
+        with self.lock:
+            metric(
+                "request_seconds",
+                "histogram",
+                "HTTP request latency by host",
+                [
+                    sample
+                    for host, h in self.latency.items()
+                    for sample in histogram({"host": host}, h)
+                ],
+            )
+            metric(
+                "responses_total",
+                "counter",
+                "HTTP responses by host and status",
+                [
+                    ("", {"host": host, "status": status}, count)
+                    for (host, status), count in self.statuses.items()
+                ],
+            )
+            metric(
+                "cache_hits_total",
+                "counter",
+                "Responses served from the response cache",
+                [("", {"host": host}, n) for host, n in self.cache_hits.items()],
+            )
+            metric(
+                "rate_limit_wait_seconds_total",
+                "counter",
+                "Time spent waiting for the rate limiter",
+                [
+                    ("", {"host": host}, round(seconds, 6))
+                    for host, seconds in self.rate_limit_wait.items()
+                ],
+            )
+            metric(
+                "unit_phase_seconds",
+                "histogram",
+                "Time per unit spent on the network, parsing and saving",
+                [
+                    sample
+                    for phase, h in self.phases.items()
+                    for sample in histogram({"phase": phase}, h)
+                ],
+            )
+            metric(
+                "unit_queries",
+                "histogram",
+                "Database queries per unit",
+                list(histogram({}, self.unit_queries)),
+            )
+            metric(
+                "query_seconds_total",
+                "counter",
+                "Time spent in database queries",
+                [("", {}, round(self.query_seconds, 6))],
+            )
+            metric(
+                "units_total",
+                "counter",
+                "Units of work by outcome",
+                [("", {"status": status}, n) for status, n in self.units.items()],
+            )
+            metric(
+                "queue_depth_max",
+                "gauge",
+                "Deepest the work queues got",
+                [("", {"queue": queue}, n) for queue, n in self.queue_max.items()],
+            )
+            metric(
+                "rows_total",
+                "counter",
+                "Rows written by the save steps",
+                [
+                    ("", {"table": table, "action": action}, n)
+                    for (table, action), n in self.rows.items()
+                ],
+            )
+            metric(
+                "run_seconds",
+                "gauge",
+                "Wall time of the run",
+                [("", {}, round(time.perf_counter() - self.started, 3))],
+            )
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,153 @@
+"""
+HTML parsing for the scrapers that read web pages.
+
+Pages are parsed with a ``SoupStrainer`` so only the elements a scraper
+reads (an infobox, the lead paragraph, a carousel) become tree nodes, the
+rest of the page is skipped as it is tokenized. lxml is used when it is
+installed, it tokenizes several times faster than ``html.parser``.
+
+Parsing is CPU bound, so fetch generators hand it to the running engine
+by yielding ``Parse(function, html)`` and get the function's result back.
+``ParserPool`` runs those on worker processes, leaving the I/O threads and
+the event loop free. Parse functions are module level and return plain
+data so they can be pickled to and from the workers.
+"""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401
+
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+
+class Parse:
+    """CPU bound work yielded by a scrape unit, runs ``function(*args)``"""
+
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+    def __call__(self):
+        return self.function(*self.args)
+
+    def __repr__(self):
+        return f"<Parse {self.function.__name__}>"
+
+
+class ParserPool:
+    """
+    Process pool for ``Parse`` work, ``workers=0`` parses on the calling thread.
+
+    Workers are spawned rather than forked, the scrapers fork from a process
+    that has threads and open database connections.
+    """
+
+    def __init__(self, workers):
+        self.executor = None
+        if workers:
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def run(self, parse):
+        if self.executor is None:
+            return parse()
+        return self.executor.submit(parse.function, *parse.args).result()
+
+    async def arun(self, parse):
+        if self.executor is None:
+            return parse()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, parse.function, *parse.args)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def _classes(attrs):
+    # While tokenizing, class is still the raw attribute string
+    classes = attrs.get("class") or ""
+    return classes if isinstance(classes, str) else " ".join(classes)
+
+
+def strained(html, keep):
+    """
+    Parse only the top level elements for which ``keep(name, attrs)`` is
+    true, together with everything inside them.
+    """
+    return BeautifulSoup(html, PARSER, parse_only=SoupStrainer(keep))
+
+
+def _infobox_or_paragraph(name, attrs):
+    return name == "p" or (name == "table" and "infobox" in _classes(attrs).split())
+
+
+def parse_article(html):
+    """
+    Lead paragraph and infobox rows of a Wikipedia article.
+
+    Returns {"description", "founded", "headquarters", "website"}, the raw
+    text of each or None when the article does not have it.
+    """
+    soup = strained(html, _infobox_or_paragraph)
+    article = dict.fromkeys(["description", "founded", "headquarters", "website"])
+
+    # The lead is the first paragraph outside the infobox that bolds the title
+    for p in soup.find_all("p", recursive=False):
+        if p.find("b"):
+            article["description"] = p.get_text()
+            break
+
+    infobox = soup.find("table", recursive=False)
+    if infobox is None:
+        return None
+    for row in infobox.find_all("tr"):
+        header = row.find("th")
+        data = row.find("td")
+        if header and data:
+            header_text = header.get_text().strip().lower()
+            data_text = data.get_text().strip()
+            if "founded" in header_text:
+                article["founded"] = data_text
+            elif "headquarters" in header_text:
+                article["headquarters"] = data_text
+            elif "website" in header_text:
+                website_link = data.find("a", href=True)
+                if website_link:
+                    article["website"] = website_link["href"]
+    return article
+
+
+def find_link(html, text):
+    """href of the first link whose text contains ``text``, case-insensitive"""
+    soup = strained(html, lambda name, attrs: name == "a" and "href" in attrs)
+    link = soup.find("a", href=True, string=lambda t: t and text.lower() in t.lower())
+    return link["href"] if link else None
+
+
+def _carousel_or_item(name, attrs):
+    return name == "g-scrolling-carousel" or (
+        name == "a" and "klitem-tr" in _classes(attrs)
+    )
+
+
+def parse_carousel(html):
+    """
+    Google's ``<g-scrolling-carousel>`` and the text of its ``klitem-tr`` items.
+
+    Returns (carousel HTML, [item text, ...]), or None without a carousel.
+    """
+    soup = strained(html, _carousel_or_item)
+    carousel = soup.find("g-scrolling-carousel")
+    if carousel is None:
+        return None
+    items = soup.find_all("a", class_=lambda c: c and "klitem-tr" in c)
+    return str(carousel), [item.get_text() for item in items]
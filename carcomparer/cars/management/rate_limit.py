@@ -0,0 +1,104 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+# Responses that mean "try again later" rather than "this request is wrong"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every thread and task talking to one host.
+
+    ``reserve`` takes a token and returns how long the caller has to wait
+    before using it, so the same bucket works with ``time.sleep`` and
+    ``asyncio.sleep``. The rate is adaptive: it halves whenever the host
+    throttles us and creeps back up to ``max_rate`` as requests succeed.
+    """
+
+    def __init__(self, rate, clock=time.monotonic):
+        self.max_rate = rate
+        self.rate = rate
+        self.clock = clock
+        self.tokens = max(1.0, rate)
+        self.updated = clock()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = self.clock()
+            burst = max(1.0, self.rate)
+            self.tokens = min(burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def throttled(self, delay):
+        with self.lock:
+            self.rate = max(self.max_rate / 64, self.rate / 2)
+            self.blocked_until = max(self.blocked_until, self.clock() + delay)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class RateLimiter:
+    """Per-host token buckets, ``rates`` maps host names to requests per second"""
+
+    def __init__(self, rates=None, default_rate=5.0, clock=time.monotonic):
+        self.rates = rates or {}
+        self.default_rate = default_rate
+        self.clock = clock
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlsplit(url).hostname
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(
+                    self.rates.get(host, self.default_rate), self.clock
+                )
+            return self.buckets[host]
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter that honours Retry-After.
+
+    ``jitter(low, high)`` picks the delay within the backoff window.
+    """
+
+    def __init__(
+        self, max_retries=3, backoff=1.0, max_backoff=60.0, jitter=random.uniform
+    ):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    def should_retry(self, attempt, response=None):
+        if attempt >= self.max_retries:
+            return False
+        return response is None or response.status_code in RETRY_STATUSES
+
+    def delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response else None
+        if retry_after:
+            try:
+                return min(self.max_backoff, float(retry_after))
+            except ValueError:
+                pass
+            try:
+                until = parsedate_to_datetime(retry_after)
+                seconds = (until - datetime.now(timezone.utc)).total_seconds()
+                return min(self.max_backoff, max(0.0, seconds))
+            except (TypeError, ValueError):
+                pass
+        return self.jitter(0, min(self.max_backoff, self.backoff * 2**attempt))
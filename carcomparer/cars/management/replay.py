@@ -0,0 +1,244 @@
+"""
+Offline stand-in for the APIs the scrapers talk to.
+
+``ReplayServer`` answers vPIC, fueleconomy.gov, Wikipedia and Wikidata requests from
+a synthetic ``FixtureCatalog`` of any size, optionally after a fixed delay
+to mimic network latency. Scrape commands are pointed at it with
+``--api-base``, which sends ``https://<host>/<path>`` to
+``<api-base>/<host>/<path>``.
+"""
+
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+VEHICLE_TYPES = ["Passenger Car", "Truck", "Multipurpose Passenger Vehicle (MPV)"]
+
+# Wikidata item of the country every fixture manufacturer is based in
+COUNTRY_ITEM = "Q1"
+
+# The query API returns the extracts of this many pages per response
+EXTRACTS_PER_RESPONSE = 20
+
+# (host, path pattern, FixtureCatalog method)
+ROUTES = [
+    ("www.fueleconomy.gov", r"/ws/rest/vehicle/menu/make", "fueleconomy_makes"),
+    ("www.fueleconomy.gov", r"/ws/rest/vehicle/menu/model", "fueleconomy_models"),
+    (
+        "vpic.nhtsa.dot.gov",
+        r"/api/vehicles/GetVehicleTypesForMake/(?P<make>[^/]+)",
+        "vpic_vehicle_types",
+    ),
+    (
+        "vpic.nhtsa.dot.gov",
+        r"/api/vehicles/getmodelsformakeyear/make/(?P<make>[^/]+)/modelyear/\d+"
+        r"(?:/vehicleType/(?P<vehicle_type>[^/]+))?",
+        "vpic_models",
+    ),
+    ("en.wikipedia.org", r"/w/api.php", "wikipedia_api"),
+    ("en.wikipedia.org", r"/wiki/(?P<title>.+)", "wikipedia_page"),
+    ("www.wikidata.org", r"/w/api.php", "wikidata_api"),
+]
+ROUTES = [(host, re.compile(pattern), name) for host, pattern, name in ROUTES]
+
+
+def _json(data):
+    return 200, "application/json", json.dumps(data).encode()
+
+
+def _xml(items):
+    menu = "".join(
+        f"<menuItem><text>{escape(text)}</text><value>{escape(text)}</value></menuItem>"
+        for text in items
+    )
+    return 200, "application/xml", f"<menuItems>{menu}</menuItems>".encode()
+
+
+def _claim(value):
+    return [{"rank": "normal", "mainsnak": {"datavalue": {"value": value}}}]
+
+
+def _website(make):
+    return f"https://{make.replace(' ', '').lower()}.example.com"
+
+
+class FixtureCatalog:
+    """
+    Deterministic fake catalog shaped like the real API responses.
+
+    ``manufacturers`` makes with ``models`` models each, every model sold in
+    ``trims`` trims. Wikipedia pages are padded to about ``page_kb`` kB of
+    HTML so parsing costs what it does on real articles.
+    """
+
+    def __init__(self, manufacturers=20, models=10, trims=3, page_kb=200):
+        self.makes = [f"Make {i:03d}" for i in range(manufacturers)]
+        self.models = [f"Model {j:03d}" for j in range(models)]
+        self.trims = [f"Trim {k}" for k in range(trims)]
+        self.page_kb = page_kb
+
+    def vehicle_type(self, model):
+        return VEHICLE_TYPES[self.models.index(model) % len(VEHICLE_TYPES)]
+
+    def respond(self, host, path, query):
+        """Returns (status, content type, body) for a request to ``host``"""
+        for route_host, pattern, name in ROUTES:
+            match = pattern.fullmatch(path)
+            if route_host == host and match:
+                return getattr(self, name)(query, **match.groupdict())
+        return 404, "application/json", b'{"error": "no fixture"}'
+
+    def fueleconomy_makes(self, query):
+        return _xml(self.makes)
+
+    def fueleconomy_models(self, query):
+        if query.get("make", [""])[0] not in self.makes:
+            return _xml([])
+        return _xml(f"{model} {trim}" for model in self.models for trim in self.trims)
+
+    def vpic_vehicle_types(self, query, make):
+        if make not in self.makes:
+            return _json({"Count": 0, "Results": []})
+        results = [{"VehicleTypeName": name} for name in VEHICLE_TYPES]
+        return _json({"Count": len(results), "Results": results})
+
+    def vpic_models(self, query, make, vehicle_type=None):
+        models = self.models if make in self.makes else []
+        if vehicle_type:
+            models = [m for m in models if self.vehicle_type(m) == vehicle_type]
+        results = [{"Make_Name": make, "Model_Name": model} for model in models]
+        return _json({"Count": len(results), "Results": results})
+
+    def wikidata_item(self, make):
+        return f"Q{1000 + self.makes.index(make)}"
+
+    def wikipedia_api(self, query):
+        if "titles" in query:
+            return self.wikipedia_query(query)
+        title = query.get("srsearch", [""])[0]
+        search = [{"title": title}] if title in self.makes else []
+        return _json({"query": {"search": search}})
+
+    def wikipedia_query(self, query):
+        titles = query["titles"][0].split("|")
+        offset = int(query.get("excontinue", ["0"])[0])
+        pages = []
+        for i, title in enumerate(titles):
+            if title not in self.makes:
+                pages.append({"title": title, "missing": True})
+                continue
+            page = {
+                "title": title,
+                "pageprops": {"wikibase_item": self.wikidata_item(title)},
+            }
+            if offset <= i < offset + EXTRACTS_PER_RESPONSE:
+                page["extract"] = f"{title} is a fictional car manufacturer.\nMore."
+            pages.append(page)
+
+        response = {"query": {"pages": pages}}
+        if offset + EXTRACTS_PER_RESPONSE < len(titles):
+            response["continue"] = {
+                "excontinue": offset + EXTRACTS_PER_RESPONSE,
+                "continue": "||",
+            }
+        return _json(response)
+
+    def wikidata_api(self, query):
+        items = {self.wikidata_item(make): make for make in self.makes}
+        entities = {}
+        for item in query.get("ids", [""])[0].split("|"):
+            if item == COUNTRY_ITEM:
+                entities[item] = {"labels": {"en": {"value": "Testland"}}}
+            elif item in items:
+                make = items[item]
+                claims = {
+                    "P571": _claim({"time": "+1950-05-12T00:00:00Z"}),
+                    "P17": _claim({"id": COUNTRY_ITEM}),
+                    "P856": _claim(_website(make)),
+                }
+                entities[item] = {"claims": claims}
+        return _json({"entities": entities})
+
+    def wikipedia_page(self, query, title):
+        title = title.replace("_", " ")
+        if title not in self.makes:
+            return 404, "text/html", b"<html><body>Not found</body></html>"
+        filler = "<p>Filler paragraph about the company's history.</p>" * (
+            self.page_kb * 1024 // 56
+        )
+        page = f"""<html><head><title>{title}</title></head><body>
+<table class="infobox">
+<tr><th>Founded</th><td>12 May 1950; 75 years ago</td></tr>
+<tr><th>Headquarters</th><td>Springfield, Testland</td></tr>
+<tr><th>Website</th><td><a href="{_website(title)}">site</a></td></tr>
+</table>
+<p><b>{title}</b> is a fictional car manufacturer[1].</p>
+{filler}
+</body></html>"""
+        return 200, "text/html", page.encode()
+
+
+class ReplayServer:
+    """
+    Threaded HTTP server for a ``FixtureCatalog``, use as a context manager.
+
+    ``requests`` counts the requests served per original API host.
+    """
+
+    def __init__(self, catalog, latency=0.0, host="127.0.0.1", port=0):
+        self.catalog = catalog
+        self.latency = latency
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so pooled clients behave as they do against the APIs
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                replay.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def handle(self, handler):
+        url = urlsplit(handler.path)
+        host, _, path = unquote(url.path).lstrip("/").partition("/")
+        with self.lock:
+            self.requests[host] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        status, content_type, body = self.catalog.respond(
+            host, "/" + path, parse_qs(url.query)
+        )
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
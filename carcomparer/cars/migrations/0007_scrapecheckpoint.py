@@ -0,0 +1,29 @@
+# Generated by Django 5.0.3 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0006_alter_price_car'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScrapeCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command', models.CharField(max_length=100)),
+                ('scrape_type', models.CharField(max_length=50)),
+                ('year', models.PositiveSmallIntegerField()),
+                ('unit', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(choices=[('done', 'Done'), ('failed', 'Failed')], max_length=10)),
+                ('error', models.TextField(blank=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('command', 'scrape_type', 'year', 'unit')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.3 on 2026-10-18 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0007_scrapecheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VariationComparison',
+            fields=[
+                ('variation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='comparison', serialize=False, to='cars.variation')),
+                ('manufacturer_name', models.CharField(max_length=100)),
+                ('model_name', models.CharField(max_length=100)),
+                ('year', models.PositiveSmallIntegerField()),
+                ('vehicle_type_name', models.CharField(blank=True, max_length=100)),
+                ('name', models.CharField(max_length=100)),
+                ('full_name', models.CharField(max_length=310)),
+                ('current_price', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('price_date', models.DateTimeField(null=True)),
+                ('tco_5_year', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('refreshed', models.DateTimeField(auto_now=True)),
+                ('manufacturer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cars.manufacturer')),
+                ('model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cars.model')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['manufacturer', 'year'], name='cars_variat_manufac_5d96a3_idx'), models.Index(fields=['vehicle_type_name', 'year'], name='cars_variat_vehicle_30ee6e_idx'), models.Index(fields=['year', 'current_price'], name='cars_variat_year_c32086_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.3 on 2026-10-18 13:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0008_variationcomparison'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='price',
+            index=models.Index(fields=['car', '-date'], name='cars_price_car_id_876efb_idx'),
+        ),
+        migrations.AddField(
+            model_name='variation',
+            name='current_price',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='cars.price'),
+        ),
+        # Point every variation at the newest of its existing prices
+        migrations.RunSQL(
+            """
+            UPDATE cars_variation
+            SET current_price_id = latest.id
+            FROM (
+                SELECT DISTINCT ON (car_id) id, car_id
+                FROM cars_price
+                ORDER BY car_id, date DESC, id DESC
+            ) AS latest
+            WHERE latest.car_id = cars_variation.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
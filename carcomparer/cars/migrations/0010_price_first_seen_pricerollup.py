@@ -0,0 +1,42 @@
+# Generated by Django 5.0.3 on 2026-10-18 14:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0009_variation_current_price_price_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='price',
+            name='first_seen',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        # Existing rows were only ever seen once
+        migrations.RunSQL(
+            "UPDATE cars_price SET first_seen = date",
+            migrations.RunSQL.noop,
+        ),
+        migrations.CreateModel(
+            name='PriceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week')], max_length=4)),
+                ('start', models.DateField()),
+                ('currency', models.CharField(default='USD', max_length=3)),
+                ('min_price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('max_price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('avg_price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('samples', models.PositiveIntegerField()),
+                ('car', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_rollups', to='cars.variation')),
+            ],
+            options={
+                'unique_together': {('car', 'period', 'start', 'currency')},
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.3 on 2026-10-18 15:05
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0010_price_first_seen_pricerollup'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='variationcomparison',
+            name='search_document',
+            field=models.CharField(default='', max_length=320),
+        ),
+        # Same text as comparison.search_document
+        migrations.RunSQL(
+            """
+            UPDATE cars_variationcomparison
+            SET search_document = lower(
+                manufacturer_name || ' ' || model_name || ' ' || name || ' ' || year
+            )
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='manufacturer',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='cars_manufacturer_name_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='model',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='cars_model_name_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='variationcomparison',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_document'], name='cars_variat_search_trgm', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,141 @@
+# Generated by Django 5.0.3 on 2026-10-18 16:10
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+# Duplicates left by earlier parallel scrapes would fail the constraints
+# below. The SQL is a copy of cars.dedup as it stood for this schema, so
+# later changes to that module do not change what this migration runs.
+
+# (map table, rows, grouping key), parents first
+LEVELS = [
+    ("dedup_manufacturer", "cars_manufacturer t", "lower(btrim(t.name))"),
+    (
+        "dedup_model",
+        "cars_model t LEFT JOIN dedup_manufacturer p ON p.old_id = t.manufacturer_id",
+        "COALESCE(p.new_id, t.manufacturer_id), t.name",
+    ),
+    (
+        "dedup_modelyear",
+        "cars_modelyear t LEFT JOIN dedup_model p ON p.old_id = t.model_id",
+        "COALESCE(p.new_id, t.model_id), t.year",
+    ),
+    (
+        "dedup_variation",
+        "cars_variation t LEFT JOIN dedup_modelyear p ON p.old_id = t.model_year_id",
+        "COALESCE(p.new_id, t.model_year_id), t.name",
+    ),
+]
+
+BUILD_MAP = """
+    CREATE TEMP TABLE {table} ON COMMIT DROP AS
+    SELECT id AS old_id, survivor AS new_id FROM (
+        SELECT t.id, first_value(t.id) OVER (
+            PARTITION BY {key} ORDER BY t.id
+        ) AS survivor
+        FROM {rows}
+    ) ranked
+    WHERE id <> survivor
+"""
+
+# Deepest level first
+MERGE = [
+    # Rollups of both cars for the same period are merged into one
+    """
+    INSERT INTO cars_pricerollup
+        (car_id, period, start, currency, min_price, max_price, avg_price, samples)
+    SELECT m.new_id, period, start, currency,
+           min_price, max_price, avg_price, samples
+    FROM cars_pricerollup
+    JOIN dedup_variation m ON m.old_id = cars_pricerollup.car_id
+    ON CONFLICT (car_id, period, start, currency) DO UPDATE SET
+        min_price = LEAST(cars_pricerollup.min_price, EXCLUDED.min_price),
+        max_price = GREATEST(cars_pricerollup.max_price, EXCLUDED.max_price),
+        avg_price = (
+            cars_pricerollup.avg_price * cars_pricerollup.samples
+            + EXCLUDED.avg_price * EXCLUDED.samples
+        ) / (cars_pricerollup.samples + EXCLUDED.samples),
+        samples = cars_pricerollup.samples + EXCLUDED.samples
+    """,
+    """
+    DELETE FROM cars_pricerollup
+    USING dedup_variation m WHERE cars_pricerollup.car_id = m.old_id
+    """,
+    """
+    UPDATE cars_price SET car_id = m.new_id
+    FROM dedup_variation m WHERE cars_price.car_id = m.old_id
+    """,
+    """
+    DELETE FROM cars_variationcomparison
+    USING dedup_variation m WHERE cars_variationcomparison.variation_id = m.old_id
+    """,
+    "DELETE FROM cars_variation USING dedup_variation m WHERE id = m.old_id",
+    """
+    UPDATE cars_variation SET model_year_id = m.new_id
+    FROM dedup_modelyear m WHERE cars_variation.model_year_id = m.old_id
+    """,
+    "DELETE FROM cars_modelyear USING dedup_modelyear m WHERE id = m.old_id",
+    """
+    UPDATE cars_modelyear SET model_id = m.new_id
+    FROM dedup_model m WHERE cars_modelyear.model_id = m.old_id
+    """,
+    """
+    UPDATE cars_variationcomparison SET model_id = m.new_id
+    FROM dedup_model m WHERE cars_variationcomparison.model_id = m.old_id
+    """,
+    "DELETE FROM cars_model USING dedup_model m WHERE id = m.old_id",
+    """
+    UPDATE cars_model SET manufacturer_id = m.new_id
+    FROM dedup_manufacturer m WHERE cars_model.manufacturer_id = m.old_id
+    """,
+    """
+    UPDATE cars_variationcomparison SET manufacturer_id = m.new_id
+    FROM dedup_manufacturer m WHERE cars_variationcomparison.manufacturer_id = m.old_id
+    """,
+    "DELETE FROM cars_manufacturer USING dedup_manufacturer m WHERE id = m.old_id",
+    # Survivors that took over prices point at the latest of them
+    """
+    UPDATE cars_variation
+    SET current_price_id = latest.id
+    FROM (
+        SELECT DISTINCT ON (car_id) id, car_id
+        FROM cars_price
+        WHERE car_id IN (SELECT new_id FROM dedup_variation)
+        ORDER BY car_id, date DESC, id DESC
+    ) AS latest
+    WHERE latest.car_id = cars_variation.id
+    """,
+]
+
+
+def merge_duplicates(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table, rows, key in LEVELS:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            cursor.execute(BUILD_MAP.format(table=table, rows=rows, key=key))
+            cursor.execute(f"CREATE UNIQUE INDEX ON {table} (old_id)")
+        for statement in MERGE:
+            cursor.execute(statement)
+        # Check the deferred foreign keys now, ALTER TABLE refuses to run
+        # with pending trigger events
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        cursor.execute("SET CONSTRAINTS ALL DEFERRED")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0011_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='manufacturer',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower(django.db.models.functions.text.Trim('name')), name='cars_manufacturer_name_key'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='variation',
+            unique_together={('model_year', 'name')},
+        ),
+    ]
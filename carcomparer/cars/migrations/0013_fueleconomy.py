@@ -0,0 +1,29 @@
+# Generated by Django 5.0.3 on 2026-10-18 19:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0012_manufacturer_name_variation_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FuelEconomy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vehicle_id', models.PositiveIntegerField(unique=True)),
+                ('fuel_type', models.CharField(blank=True, max_length=50)),
+                ('engine', models.CharField(blank=True, max_length=50)),
+                ('transmission', models.CharField(blank=True, max_length=50)),
+                ('drive', models.CharField(blank=True, max_length=50)),
+                ('city_mpg', models.PositiveSmallIntegerField(null=True)),
+                ('highway_mpg', models.PositiveSmallIntegerField(null=True)),
+                ('combined_mpg', models.PositiveSmallIntegerField(null=True)),
+                ('car', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fuel_economy', to='cars.variation')),
+            ],
+        ),
+    ]
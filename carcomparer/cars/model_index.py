@@ -0,0 +1,67 @@
+from bisect import bisect_left
+
+
+def normalize_name(name):
+    """Case and whitespace insensitive form of a model name used for matching"""
+    return " ".join(name.casefold().split())
+
+
+class ModelIndex:
+    """
+    In-memory lookup of models by name, built once per manufacturer.
+
+    Matches a free text vehicle name (e.g. fueleconomy.gov's "Camry Hybrid LE")
+    against known model names by trying the longest leading run of words first.
+    A run matches a model whose normalized name equals it, starts with it, or
+    otherwise contains it, in that order of preference. This is the same rule
+    as the ``name__icontains`` queries it replaces, without touching the
+    database. Every suffix of every name is indexed up front, so containment
+    is a bisect too rather than a scan of the model names.
+    """
+
+    def __init__(self, models):
+        """``models`` is an iterable of (id, name, label) tuples"""
+        self.by_name = {}
+        self.labels = {}
+        for model_id, name, label in sorted(models):
+            self.by_name.setdefault(normalize_name(name), model_id)
+            self.labels[model_id] = label
+        self.names = sorted(self.by_name)
+
+        # A name contains the candidate when one of its suffixes starts with
+        # it, the whole name is left out as prefixes are found above
+        self.suffixes = sorted(
+            (name[i:], name) for name in self.names for i in range(1, len(name))
+        )
+        self.contained = {}
+
+    def lookup(self, candidate):
+        model_id = self.by_name.get(candidate)
+        if model_id is not None:
+            return model_id
+
+        # Names starting with the candidate sit right after it in sorted order
+        i = bisect_left(self.names, candidate)
+        if i < len(self.names) and self.names[i].startswith(candidate):
+            return self.by_name[self.names[i]]
+
+        if candidate not in self.contained:
+            # Suffixes starting with the candidate are one run in sorted order
+            names = []
+            i = bisect_left(self.suffixes, (candidate,))
+            while i < len(self.suffixes) and self.suffixes[i][0].startswith(candidate):
+                names.append(self.suffixes[i][1])
+                i += 1
+            self.contained[candidate] = self.by_name[min(names)] if names else None
+        return self.contained[candidate]
+
+    def match(self, full_name):
+        """Return (model id, variation name) for ``full_name``, or None"""
+        parts = full_name.split(" ")
+        for i in range(len(parts), 0, -1):
+            model_id = self.lookup(normalize_name(" ".join(parts[:i])))
+            if model_id is not None:
+                # Whatever follows the model name is the variation
+                variation_name = " ".join(parts[i:]) if i < len(parts) else "Base"
+                return model_id, variation_name
+        return None
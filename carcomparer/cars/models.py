@@ -1,4 +1,9 @@
+from decimal import Decimal
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models import Avg, OuterRef, Subquery
+from django.db.models.functions import Lower, Trim, Upper
+from django.utils import timezone
 
 
 # Eg. Toyota, Ford, Honda, etc.
@@ -12,6 +17,22 @@ class Manufacturer(models.Model):
     def __str__(self):
         return self.name
 
+    class Meta:
+        constraints = [
+            # "Toyota", "TOYOTA" and "Toyota " are the same manufacturer,
+            # see bulk.get_or_create_manufacturers
+            models.UniqueConstraint(
+                Lower(Trim("name")), name="cars_manufacturer_name_key"
+            ),
+        ]
+        # Trigram index matching the UPPER(...) LIKE of icontains lookups
+        indexes = [
+            GinIndex(
+                OpClass(Upper("name"), name="gin_trgm_ops"),
+                name="cars_manufacturer_name_trgm",
+            ),
+        ]
+
 
 # Truck, Motorcycle, Passenger Car etc.
 class VehicleType(models.Model):
@@ -44,6 +65,12 @@ class Model(models.Model):
 
     class Meta:
         unique_together = ["manufacturer", "name"]
+        indexes = [
+            GinIndex(
+                OpClass(Upper("name"), name="gin_trgm_ops"),
+                name="cars_model_name_trgm",
+            ),
+        ]
 
 
 class ModelYear(models.Model):
@@ -63,6 +90,27 @@ class ModelYear(models.Model):
         unique_together = ["model", "year"]
 
 
+class VariationQuerySet(models.QuerySet):
+    def with_current_price(self):
+        """Join each variation's latest Price, one query however long the history"""
+        return self.select_related("current_price")
+
+    def with_mpg(self):
+        """Annotate ``mpg``, the average combined MPG of the variation's engines"""
+        mpg = (
+            FuelEconomy.objects.filter(car=OuterRef("pk"))
+            .values("car")
+            .annotate(mpg=Avg("combined_mpg"))
+            .values("mpg")
+        )
+        return self.annotate(mpg=Subquery(mpg))
+
+    def refresh_current_prices(self):
+        """Re-point current_price at the newest Price, e.g. after prices were deleted"""
+        latest = Price.objects.filter(car=OuterRef("pk")).order_by("-date", "-pk")
+        return self.update(current_price=Subquery(latest.values("pk")[:1]))
+
+
 # Eg. XLE, LX, EX, etc.
 class Variation(models.Model):
     # FUEL_TYPE_CHOICES = [
@@ -77,6 +125,12 @@ class Variation(models.Model):
         ModelYear, related_name="variations", on_delete=models.CASCADE
     )
     name = models.CharField(max_length=100)  # e.g., "Sport", "LX", "GT"
+    # Latest Price of this variation, kept up to date by Price.save
+    current_price = models.OneToOneField(
+        "Price", related_name="+", on_delete=models.SET_NULL, null=True, blank=True
+    )
+
+    objects = VariationQuerySet.as_manager()
 
     @property
     def full_name(self):
@@ -85,12 +139,165 @@ class Variation(models.Model):
     def __str__(self):
         return self.full_name
 
+    class Meta:
+        unique_together = ["model_year", "name"]
+
+
+class PriceQuerySet(models.QuerySet):
+    def record(self, car, price, currency="USD"):
+        """
+        Store an observed price of ``car``.
+
+        If it is the same as the current price the existing row is extended
+        (its ``date`` moves forward) instead of adding a duplicate point.
+        """
+        current = self.filter(car=car).order_by("-date").first()
+        if (
+            current is not None
+            and current.price == Decimal(str(price))
+            and current.currency == currency
+        ):
+            current.save(update_fields=["date"])
+            return current
+        return self.create(car=car, price=price, currency=currency)
+
 
+# A price observed from first_seen until date. Rows older than a month are
+# downsampled into PriceRollup by the rollup_prices command.
 class Price(models.Model):
     car = models.ForeignKey(Variation, related_name="prices", on_delete=models.CASCADE)
     price = models.DecimalField(max_digits=12, decimal_places=2)
     currency = models.CharField(max_length=3, default="USD")
+    first_seen = models.DateTimeField(default=timezone.now)
     date = models.DateTimeField(auto_now=True)
 
+    objects = PriceQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # date is auto_now, so the price just saved is always the newest one
+        Variation.objects.filter(pk=self.car_id).update(current_price=self)
+
     def __str__(self):
         return f"{self.car.full_name} - {self.price} {self.currency}"
+
+    class Meta:
+        indexes = [models.Index(fields=["car", "-date"])]
+
+
+# Downsampled price history: one row per car per day, or per week for old data
+class PriceRollup(models.Model):
+    DAY = "day"
+    WEEK = "week"
+    PERIOD_CHOICES = [
+        (DAY, "Day"),
+        (WEEK, "Week"),
+    ]
+
+    car = models.ForeignKey(
+        Variation, related_name="price_rollups", on_delete=models.CASCADE
+    )
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    start = models.DateField()
+    currency = models.CharField(max_length=3, default="USD")
+    min_price = models.DecimalField(max_digits=12, decimal_places=2)
+    max_price = models.DecimalField(max_digits=12, decimal_places=2)
+    avg_price = models.DecimalField(max_digits=12, decimal_places=2)
+    samples = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.car_id} {self.period} of {self.start}: {self.avg_price}"
+
+    class Meta:
+        unique_together = ["car", "period", "start", "currency"]
+
+
+# One vehicle of the fueleconomy.gov dataset. A variation sold with several
+# engines or transmissions has one row for each, see cars.fueleconomy.
+class FuelEconomy(models.Model):
+    car = models.ForeignKey(
+        Variation, related_name="fuel_economy", on_delete=models.CASCADE
+    )
+    # fueleconomy.gov's own id of the vehicle
+    vehicle_id = models.PositiveIntegerField(unique=True)
+    fuel_type = models.CharField(max_length=50, blank=True)
+    engine = models.CharField(max_length=50, blank=True)  # e.g., "2.5 L 4 cyl"
+    transmission = models.CharField(max_length=50, blank=True)
+    drive = models.CharField(max_length=50, blank=True)
+    city_mpg = models.PositiveSmallIntegerField(null=True)
+    highway_mpg = models.PositiveSmallIntegerField(null=True)
+    combined_mpg = models.PositiveSmallIntegerField(null=True)
+
+    def __str__(self):
+        return (
+            f"{self.car_id} {self.engine} {self.transmission}: {self.combined_mpg} mpg"
+        )
+
+
+# Progress of a scrape command, one row per (year, unit) so runs can be resumed
+class ScrapeCheckpoint(models.Model):
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    command = models.CharField(max_length=100)
+    scrape_type = models.CharField(max_length=50)
+    year = models.PositiveSmallIntegerField()
+    unit = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    error = models.TextField(blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return (
+            f"{self.command} {self.scrape_type} {self.year} {self.unit}: {self.status}"
+        )
+
+    class Meta:
+        unique_together = ["command", "scrape_type", "year", "unit"]
+
+
+# Flattened row per Variation for side by side comparisons, so reads never walk
+# the Variation -> ModelYear -> Model -> Manufacturer chain.
+# Maintained by carcomparer.cars.comparison.refresh_comparisons.
+class VariationComparison(models.Model):
+    variation = models.OneToOneField(
+        Variation,
+        primary_key=True,
+        related_name="comparison",
+        on_delete=models.CASCADE,
+    )
+    manufacturer = models.ForeignKey(
+        Manufacturer, related_name="+", on_delete=models.CASCADE
+    )
+    manufacturer_name = models.CharField(max_length=100)
+    model = models.ForeignKey(Model, related_name="+", on_delete=models.CASCADE)
+    model_name = models.CharField(max_length=100)
+    year = models.PositiveSmallIntegerField()
+    vehicle_type_name = models.CharField(max_length=100, blank=True)
+    name = models.CharField(max_length=100)
+    full_name = models.CharField(max_length=310)
+    # Lower case "manufacturer model name year" matched by cars.search
+    search_document = models.CharField(max_length=320, default="")
+    current_price = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    price_date = models.DateTimeField(null=True)
+    tco_5_year = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    refreshed = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.full_name
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["manufacturer", "year"]),
+            models.Index(fields=["vehicle_type_name", "year"]),
+            models.Index(fields=["year", "current_price"]),
+            GinIndex(
+                fields=["search_document"],
+                opclasses=["gin_trgm_ops"],
+                name="cars_variat_search_trgm",
+            ),
+        ]
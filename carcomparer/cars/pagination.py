@@ -0,0 +1,44 @@
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination
+
+
+class CatalogCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key.
+
+    Unlike page numbers it never counts the table or uses OFFSET, so deep
+    pages cost the same as the first one.
+    """
+
+    ordering = "pk"
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Admin paginator for tables too big to COUNT(*) on every page view.
+
+    Unfiltered lists take the row count from the planner statistics in
+    pg_class. Filtered lists, and tables small enough that the estimate
+    would be noticeably off, are counted exactly.
+    """
+
+    exact_below = 10000
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [self.object_list.model._meta.db_table],
+                )
+                estimate = cursor.fetchone()[0]
+            # -1 means the table has never been analyzed
+            if estimate >= self.exact_below:
+                return estimate
+        return super().count
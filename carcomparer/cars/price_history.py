@@ -0,0 +1,175 @@
+"""
+Price history over time.
+
+Recent prices are kept as raw ``Price`` rows, each covering the run from
+``first_seen`` to ``date`` during which the price did not change. Older rows
+are downsampled into daily ``PriceRollup`` rows, one sample for every day of
+the run, and old daily rows into weekly ones, so the history of a car grows
+by at most one row per week once it has aged out. The current price of a
+variation is never rolled up.
+"""
+
+from collections import defaultdict
+from datetime import datetime, time, timezone
+
+from django.db import connection, transaction
+from .models import Price, PriceRollup
+
+# Raw prices that are not the current price of their variation
+_IS_OLD_PRICE = """
+    date < %(cutoff)s
+    AND id NOT IN (
+        SELECT current_price_id FROM cars_variation
+        WHERE current_price_id IS NOT NULL
+    )
+"""
+
+# Merge a new aggregate into an existing rollup of the same car and period
+_MERGE_ROLLUP = """
+    ON CONFLICT (car_id, period, start, currency) DO UPDATE SET
+        min_price = LEAST(cars_pricerollup.min_price, EXCLUDED.min_price),
+        max_price = GREATEST(cars_pricerollup.max_price, EXCLUDED.max_price),
+        avg_price = (
+            cars_pricerollup.avg_price * cars_pricerollup.samples
+            + EXCLUDED.avg_price * EXCLUDED.samples
+        ) / (cars_pricerollup.samples + EXCLUDED.samples),
+        samples = cars_pricerollup.samples + EXCLUDED.samples
+"""
+
+_ROLLUP_COLUMNS = """
+    INSERT INTO cars_pricerollup
+        (car_id, period, start, currency, min_price, max_price, avg_price, samples)
+"""
+
+
+def rollup_daily(cutoff):
+    """Downsample raw prices last seen before ``cutoff`` into daily rollups"""
+    params = {"cutoff": cutoff, "period": PriceRollup.DAY}
+    with transaction.atomic(), connection.cursor() as cursor:
+        # A price counts once for every day from first_seen to date
+        cursor.execute(
+            f"""
+            {_ROLLUP_COLUMNS}
+            SELECT car_id, %(period)s, day::date, currency,
+                   MIN(price), MAX(price), AVG(price), COUNT(*)
+            FROM cars_price
+            CROSS JOIN LATERAL generate_series(
+                date_trunc('day', LEAST(first_seen, date) AT TIME ZONE 'UTC'),
+                date_trunc('day', date AT TIME ZONE 'UTC'),
+                interval '1 day'
+            ) AS day
+            WHERE {_IS_OLD_PRICE}
+            GROUP BY car_id, day, currency
+            {_MERGE_ROLLUP}
+            """,
+            params,
+        )
+        cursor.execute(f"DELETE FROM cars_price WHERE {_IS_OLD_PRICE}", params)
+        return cursor.rowcount
+
+
+def rollup_weekly(cutoff):
+    """Merge daily rollups starting before ``cutoff`` into weekly rollups"""
+    week = "date_trunc('week', start)::date"
+    params = {"cutoff": cutoff, "day": PriceRollup.DAY, "week": PriceRollup.WEEK}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            {_ROLLUP_COLUMNS}
+            SELECT car_id, %(week)s, {week}, currency,
+                   MIN(min_price), MAX(max_price),
+                   SUM(avg_price * samples) / SUM(samples), SUM(samples)
+            FROM cars_pricerollup
+            WHERE period = %(day)s AND start < %(cutoff)s
+            GROUP BY car_id, {week}, currency
+            {_MERGE_ROLLUP}
+            """,
+            params,
+        )
+        cursor.execute(
+            """
+            DELETE FROM cars_pricerollup
+            WHERE period = %(day)s AND start < %(cutoff)s
+            """,
+            params,
+        )
+        return cursor.rowcount
+
+
+def reassign_rollups(cursor, mapping):
+    """
+    Move rollups to another car, merging periods both cars have.
+
+    ``mapping`` is the name of a table of (old_id, new_id) variation pairs,
+    e.g. duplicates found by ``cars.dedup``.
+    """
+    cursor.execute(
+        f"""
+        {_ROLLUP_COLUMNS}
+        SELECT mapping.new_id, period, start, currency,
+               min_price, max_price, avg_price, samples
+        FROM cars_pricerollup
+        JOIN {mapping} mapping ON mapping.old_id = cars_pricerollup.car_id
+        {_MERGE_ROLLUP}
+        """
+    )
+    cursor.execute(
+        f"""
+        DELETE FROM cars_pricerollup
+        USING {mapping} mapping
+        WHERE mapping.old_id = cars_pricerollup.car_id
+        """
+    )
+
+
+def _midnight(day):
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+def price_history(variation_ids, start, end):
+    """
+    Price history of many variations between ``start`` and ``end``.
+
+    Returns {variation id: [point, ...]} with points oldest first. Rollups
+    come back as one point per day or week with their min, max and average,
+    raw prices as a single point. Two queries regardless of the number of
+    variations.
+    """
+    history = defaultdict(list)
+
+    rollups = PriceRollup.objects.filter(
+        car_id__in=variation_ids, start__gte=start.date(), start__lte=end.date()
+    ).values_list(
+        "car_id", "period", "start", "currency", "min_price", "max_price", "avg_price"
+    )
+    for car_id, period, day, currency, low, high, average in rollups:
+        history[car_id].append(
+            {
+                "period": period,
+                "date": _midnight(day),
+                "price": average,
+                "min": low,
+                "max": high,
+                "currency": currency,
+            }
+        )
+
+    prices = Price.objects.filter(
+        car_id__in=variation_ids, date__gte=start, first_seen__lte=end
+    ).values_list("car_id", "first_seen", "date", "price", "currency")
+    for car_id, first_seen, date, price, currency in prices:
+        history[car_id].append(
+            {
+                "period": "raw",
+                "date": date,
+                "first_seen": first_seen,
+                "price": price,
+                "min": price,
+                "max": price,
+                "currency": currency,
+            }
+        )
+
+    for points in history.values():
+        points.sort(key=lambda point: point["date"])
+    return dict(history)
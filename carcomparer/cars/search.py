@@ -0,0 +1,61 @@
+"""
+Typo tolerant catalog search.
+
+Queries run against ``VariationComparison.search_document``, one lower case
+"manufacturer model name year" string per variation with a pg_trgm GIN
+index. Trigram word similarity ignores word order and survives typos, so
+"camry xle 2023" and "toyta camry" both find "Toyota Camry XLE". Four digit
+numbers in the query are treated as model years and become an exact filter.
+"""
+
+import re
+
+from django.contrib.postgres.search import TrigramWordSimilarity
+from .models import VariationComparison
+
+YEAR = re.compile(r"^(19|20)\d\d$")
+
+
+def parse_query(query):
+    """Split ``query`` into (text, years)"""
+    words, years = [], []
+    for word in query.lower().split():
+        if YEAR.match(word):
+            years.append(int(word))
+        else:
+            words.append(word)
+    return " ".join(words), years
+
+
+def search_variations(query, limit=20):
+    """Best matching comparison rows for ``query``, each annotated with ``rank``"""
+    text, years = parse_query(query)
+    rows = VariationComparison.objects.all()
+    if years:
+        rows = rows.filter(year__in=years)
+    if not text:
+        return rows.order_by("full_name")[:limit]
+
+    return (
+        rows.filter(search_document__trigram_word_similar=text)
+        .annotate(rank=TrigramWordSimilarity(text, "search_document"))
+        .order_by("-rank", "full_name")[:limit]
+    )
+
+
+def autocomplete(query, limit=10):
+    """
+    "Manufacturer Model" suggestions for a partly typed query.
+
+    Suggestions come from the best matching variations so they share the
+    search index, ``limit * 5`` rows are enough to fill ``limit`` distinct
+    models in practice.
+    """
+    suggestions = []
+    for row in search_variations(query, limit * 5):
+        label = f"{row.manufacturer_name} {row.model_name}"
+        if label not in suggestions:
+            suggestions.append(label)
+            if len(suggestions) == limit:
+                break
+    return suggestions
@@ -0,0 +1,168 @@
+from datetime import timedelta
+
+from django.utils import timezone
+from rest_framework import serializers
+from .models import *
+
+
+class FieldSelectionMixin:
+    """
+    Lets clients trim responses with ``?fields=id,name``.
+
+    Unknown field names are ignored so old clients keep working as fields are
+    added or removed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        fields = request.query_params.get("fields") if request else None
+        if fields:
+            selected = set(fields.split(","))
+            for name in set(self.fields) - selected:
+                self.fields.pop(name)
+
+
+class ManufacturerSerializer(FieldSelectionMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Manufacturer
+        fields = ["id", "name", "country", "founded_date", "description", "website"]
+
+
+class CarModelSerializer(FieldSelectionMixin, serializers.ModelSerializer):
+    # Needs select_related("manufacturer", "vehicle_type")
+    manufacturer_name = serializers.CharField(source="manufacturer.name")
+    vehicle_type = serializers.CharField(source="vehicle_type.name", default=None)
+
+    class Meta:
+        model = Model
+        fields = ["id", "name", "manufacturer", "manufacturer_name", "vehicle_type"]
+
+
+class VariationSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Variation
+        fields = ["id", "name"]
+
+
+class ModelYearSerializer(FieldSelectionMixin, serializers.ModelSerializer):
+    # Needs select_related("model__manufacturer") and prefetch_related("variations")
+    full_name = serializers.CharField()
+    variations = VariationSummarySerializer(many=True)
+
+    class Meta:
+        model = ModelYear
+        fields = ["id", "year", "model", "full_name", "variations"]
+
+
+class VariationSerializer(FieldSelectionMixin, serializers.ModelSerializer):
+    # Needs select_related("model_year__model__manufacturer")
+    year = serializers.IntegerField(source="model_year.year")
+    model = serializers.IntegerField(source="model_year.model_id")
+    manufacturer = serializers.IntegerField(source="model_year.model.manufacturer_id")
+    full_name = serializers.CharField()
+    # Needs with_current_price()
+    current_price = serializers.DecimalField(
+        source="current_price.price", max_digits=12, decimal_places=2, default=None
+    )
+
+    class Meta:
+        model = Variation
+        fields = [
+            "id",
+            "name",
+            "model_year",
+            "year",
+            "model",
+            "manufacturer",
+            "full_name",
+            "current_price",
+        ]
+
+
+class PriceSerializer(FieldSelectionMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Price
+        fields = ["id", "car", "price", "currency", "first_seen", "date"]
+
+
+class VariationComparisonSerializer(FieldSelectionMixin, serializers.ModelSerializer):
+    class Meta:
+        model = VariationComparison
+        fields = [
+            "variation",
+            "manufacturer",
+            "manufacturer_name",
+            "model",
+            "model_name",
+            "year",
+            "vehicle_type_name",
+            "name",
+            "full_name",
+            "current_price",
+            "price_date",
+            "tco_5_year",
+        ]
+
+
+class VariationSearchSerializer(VariationComparisonSerializer):
+    rank = serializers.FloatField(read_only=True, default=None)
+
+    class Meta(VariationComparisonSerializer.Meta):
+        fields = VariationComparisonSerializer.Meta.fields + ["rank"]
+
+
+class CommaSeparatedListField(serializers.ListField):
+    """List field that also accepts ``1,2,3`` in a query string"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, list) and len(data) == 1:
+            data = data[0]
+        if isinstance(data, str):
+            data = [item for item in data.split(",") if item]
+        return super().to_internal_value(data)
+
+
+class TCOQuerySerializer(serializers.Serializer):
+    """Query parameters of the cost of ownership endpoint, see tco.Assumptions"""
+
+    variations = CommaSeparatedListField(
+        child=serializers.IntegerField(), min_length=1, max_length=500
+    )
+    years = serializers.IntegerField(min_value=1, max_value=15, default=5)
+    annual_miles = serializers.FloatField(min_value=0, default=12000)
+    fuel_price = serializers.FloatField(min_value=0, default=3.50)
+    mpg = serializers.FloatField(min_value=1, default=25.0)
+    depreciation = CommaSeparatedListField(
+        child=serializers.FloatField(min_value=0, max_value=1),
+        min_length=1,
+        default=[0.20, 0.15],
+    )
+    insurance = serializers.FloatField(min_value=0, default=1500.0)
+    insurance_growth = serializers.FloatField(default=0.03)
+    maintenance = serializers.FloatField(min_value=0, default=500.0)
+    maintenance_growth = serializers.FloatField(default=0.10)
+
+
+class PriceHistoryQuerySerializer(serializers.Serializer):
+    """Query parameters of the price history endpoint"""
+
+    variations = CommaSeparatedListField(
+        child=serializers.IntegerField(), min_length=1, max_length=500
+    )
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        data.setdefault("end", timezone.now())
+        data.setdefault("start", data["end"] - timedelta(days=365))
+        if data["start"] > data["end"]:
+            raise serializers.ValidationError("start must be before end")
+        return data
+
+
+class SearchQuerySerializer(serializers.Serializer):
+    """Query parameters of the search and autocomplete endpoints"""
+
+    q = serializers.CharField(min_length=2, max_length=100)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
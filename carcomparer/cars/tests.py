@@ -1,3 +1,1042 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import zipfile
+from datetime import timedelta
+from email.utils import format_datetime
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from .comparison import refresh_comparisons
+from .bulk import bulk_get_or_create, get_or_create_manufacturers
+from .dedup import remove_duplicates
+from .fueleconomy import split_model
+from .management.commands.scrape_fueleconomy import iter_menu_items
+from .management.http_cache import ResponseCache
+from .management.http_client import HttpClient, Request, Response
+from .management.base_scrape import BaseAPICommand
+from .management.commands import scrape_nhtsa
+from .management.metrics import QueryCounter, ScrapeMetrics, UnitTimer
+from .management.rate_limit import RateLimiter, RetryPolicy, TokenBucket
+from .management.parsing import find_link, parse_article, parse_carousel
+from .management.replay import FixtureCatalog, ReplayServer
+from .model_index import ModelIndex
+from .models import *
+from .price_history import price_history, rollup_daily, rollup_weekly
+from .search import autocomplete, parse_query, search_variations
+from .tco import Assumptions, compute_tco, tco_for_variations
+
+
+def create_catalog(
+    manufacturers=3, models=3, years=2, variations=2, prices=2, first_manufacturer=0
+):
+    vehicle_type, _ = VehicleType.objects.get_or_create(name="Passenger Car")
+    for m in range(first_manufacturer, first_manufacturer + manufacturers):
+        manufacturer = Manufacturer.objects.create(name=f"Make {m}")
+        for n in range(models):
+            model = Model.objects.create(
+                manufacturer=manufacturer, name=f"Model {n}", vehicle_type=vehicle_type
+            )
+            for year in range(2020, 2020 + years):
+                model_year = ModelYear.objects.create(model=model, year=year)
+                for v in range(variations):
+                    variation = Variation.objects.create(
+                        model_year=model_year, name=f"Trim {v}"
+                    )
+                    for p in range(prices):
+                        Price.objects.create(car=variation, price=20000 + p)
+
+
+class CatalogAPITests(TestCase):
+    # Queries per list page, these must not grow with the number of rows
+    QUERY_BUDGETS = {
+        "/api/v1/manufacturers/": 1,
+        "/api/v1/models/": 1,
+        "/api/v1/model-years/": 2,
+        "/api/v1/variations/": 1,
+        "/api/v1/prices/": 1,
+        "/api/v1/comparisons/": 1,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog()
+        refresh_comparisons()
+
+    def test_list_query_budgets(self):
+        for url, budget in self.QUERY_BUDGETS.items():
+            with self.subTest(url=url), self.assertNumQueries(budget):
+                response = self.client.get(url, {"page_size": 1000})
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.json()["results"])
+
+    def test_query_budget_is_flat(self):
+        # Ten times the variations still costs the same queries per page
+        create_catalog(
+            manufacturers=1, models=5, variations=20, prices=1, first_manufacturer=3
+        )
+        with self.assertNumQueries(1):
+            self.client.get("/api/v1/variations/", {"page_size": 1000})
+
+    def test_cursor_pagination(self):
+        first = self.client.get("/api/v1/models/", {"page_size": 5}).json()
+        self.assertEqual(len(first["results"]), 5)
+        second = self.client.get(first["next"]).json()
+        first_ids = {row["id"] for row in first["results"]}
+        self.assertFalse(first_ids & {row["id"] for row in second["results"]})
+
+    def test_field_selection(self):
+        response = self.client.get("/api/v1/variations/", {"fields": "id,full_name"})
+        for row in response.json()["results"]:
+            self.assertEqual(set(row), {"id", "full_name"})
+
+    def test_filters(self):
+        manufacturer = Manufacturer.objects.get(name="Make 1")
+        response = self.client.get("/api/v1/models/", {"manufacturer": manufacturer.id})
+        rows = response.json()["results"]
+        self.assertEqual(len(rows), 3)
+        self.assertTrue(all(row["manufacturer_name"] == "Make 1" for row in rows))
+
+    def test_invalid_filter(self):
+        response = self.client.get("/api/v1/models/", {"manufacturer": "abc"})
+        self.assertEqual(response.status_code, 400)
+
+
+class AdminTests(TestCase):
+    URLS = [
+        "/admin/cars/model/",
+        "/admin/cars/modelyear/",
+        "/admin/cars/variation/",
+        "/admin/cars/price/",
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(manufacturers=1, models=2, years=1, variations=2, prices=1)
+        cls.user = User.objects.create_superuser("admin", "admin@example.com", "pw")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def pages(self):
+        price = Price.objects.first()
+        return self.URLS + [
+            f"/admin/cars/price/{price.pk}/change/",
+            f"/admin/cars/variation/{price.car_id}/change/",
+        ]
+
+    def test_query_counts_do_not_grow(self):
+        # The first change form warms per-process caches (e.g. content types)
+        for url in self.pages():
+            self.count_queries(url)
+        before = [self.count_queries(url) for url in self.pages()]
+        create_catalog(
+            manufacturers=2,
+            models=5,
+            years=2,
+            variations=5,
+            prices=2,
+            first_manufacturer=1,
+        )
+        after = [self.count_queries(url) for url in self.pages()]
+        self.assertEqual(before, after)
+
+
+class ComparisonTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(manufacturers=2, models=1, years=1, variations=1, prices=1)
+
+    def test_refresh_flattens_catalog(self):
+        self.assertEqual(refresh_comparisons(), 2)
+        row = VariationComparison.objects.get(manufacturer_name="Make 0")
+        self.assertEqual(row.full_name, "2020 Make 0 Model 0 Trim 0")
+        self.assertEqual(row.vehicle_type_name, "Passenger Car")
+        self.assertEqual(row.current_price, 20000)
+        self.assertGreater(row.tco_5_year, 0)
+
+    def test_incremental_refresh(self):
+        refresh_comparisons()
+        variation = Variation.objects.get(
+            model_year__model__manufacturer__name="Make 1"
+        )
+        Price.objects.create(car=variation, price=25000)
+
+        refreshed = refresh_comparisons(Variation.objects.filter(pk=variation.pk))
+        self.assertEqual(refreshed, 1)
+        row = VariationComparison.objects.get(pk=variation.pk)
+        self.assertEqual(row.current_price, 25000)
+        other = VariationComparison.objects.get(manufacturer_name="Make 0")
+        self.assertEqual(other.current_price, 20000)
+
+
+class CurrentPriceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(manufacturers=1, models=1, years=1, variations=2, prices=3)
+
+    def test_pointer_follows_newest_price(self):
+        variation = Variation.objects.first()
+        price = Price.objects.create(car=variation, price=31000)
+        variation.refresh_from_db()
+        self.assertEqual(variation.current_price, price)
+
+    def test_one_query_for_many_variations(self):
+        with self.assertNumQueries(1):
+            prices = [
+                variation.current_price.price
+                for variation in Variation.objects.with_current_price()
+            ]
+        self.assertEqual(prices, [20002, 20002])
+
+    def test_refresh_after_delete(self):
+        variation = Variation.objects.first()
+        variation.current_price.delete()
+        Variation.objects.filter(pk=variation.pk).refresh_current_prices()
+        variation.refresh_from_db()
+        self.assertEqual(variation.current_price.price, 20001)
+
+
+class PriceHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(manufacturers=1, models=1, years=1, variations=2, prices=0)
+
+    def add_price(self, variation, price, seen):
+        price = Price.objects.create(car=variation, price=price, first_seen=seen)
+        Price.objects.filter(pk=price.pk).update(date=seen)
+        return price
+
+    def test_unchanged_price_is_not_duplicated(self):
+        variation = Variation.objects.first()
+        first = Price.objects.record(variation, 30000)
+        self.assertEqual(Price.objects.record(variation, "30000.00"), first)
+        Price.objects.record(variation, 29000)
+        self.assertEqual(variation.prices.count(), 2)
+
+    def test_rollups(self):
+        variation = Variation.objects.first()
+        now = timezone.now()
+        old = (now - timedelta(days=400)).replace(hour=0, minute=0)
+        self.add_price(variation, 100, old)
+        self.add_price(variation, 300, old + timedelta(hours=1))
+        self.add_price(variation, 200, old + timedelta(days=1))
+        current = Price.objects.create(car=variation, price=400)
+        Price.objects.filter(pk=current.pk).update(date=old)
+
+        self.assertEqual(rollup_daily(now - timedelta(days=30)), 3)
+        days = PriceRollup.objects.filter(period=PriceRollup.DAY).order_by("start")
+        self.assertEqual([day.avg_price for day in days], [200, 200])
+        self.assertEqual([day.samples for day in days], [2, 1])
+        # The current price stays a raw row
+        self.assertEqual(list(variation.prices.all()), [current])
+
+        self.assertEqual(rollup_weekly((now - timedelta(days=365)).date()), 2)
+        weeks = PriceRollup.objects.filter(period=PriceRollup.WEEK)
+        self.assertEqual(sum(week.samples for week in weeks), 3)
+        self.assertEqual(min(week.min_price for week in weeks), 100)
+        self.assertEqual(max(week.max_price for week in weeks), 300)
+
+    def test_rollup_covers_unchanged_run(self):
+        variation = Variation.objects.first()
+        now = timezone.now()
+        price = self.add_price(variation, 100, now - timedelta(days=50))
+        Price.objects.filter(pk=price.pk).update(date=now - timedelta(days=40))
+        Price.objects.create(car=variation, price=200)
+
+        rollup_daily(now - timedelta(days=30))
+        days = PriceRollup.objects.filter(period=PriceRollup.DAY)
+        self.assertEqual(days.count(), 11)
+        self.assertEqual({day.avg_price for day in days}, {100})
+        history = price_history(
+            [variation.pk], now - timedelta(days=48), now - timedelta(days=45)
+        )
+        self.assertEqual(len(history[variation.pk]), 4)
+
+    def test_range_query(self):
+        first, second = Variation.objects.all()
+        now = timezone.now()
+        self.add_price(first, 100, now - timedelta(days=60))
+        self.add_price(first, 200, now - timedelta(days=10))
+        self.add_price(second, 300, now - timedelta(days=5))
+        rollup_daily(now - timedelta(days=30))
+
+        with self.assertNumQueries(2):
+            history = price_history(
+                [first.pk, second.pk], now - timedelta(days=90), now
+            )
+        self.assertEqual([p["period"] for p in history[first.pk]], ["day", "raw"])
+        self.assertEqual([p["price"] for p in history[first.pk]], [100, 200])
+        self.assertEqual([p["price"] for p in history[second.pk]], [300])
+
+        response = self.client.get(
+            "/api/v1/price-history/", {"variations": f"{first.pk},{second.pk}"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"][str(first.pk)]), 2)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(manufacturers=1, models=1, years=1, variations=1, prices=1)
+        model_year = ModelYear.objects.create(
+            model=Model.objects.create(
+                manufacturer=Manufacturer.objects.create(name="Toyota"), name="Camry"
+            ),
+            year=2023,
+        )
+        Variation.objects.create(model_year=model_year, name="XLE")
+        Variation.objects.create(model_year=model_year, name="LE")
+        refresh_comparisons()
+
+    def test_parse_query(self):
+        self.assertEqual(parse_query("Camry XLE 2023"), ("camry xle", [2023]))
+
+    def test_ranked_and_typo_tolerant(self):
+        for query in ["camry xle 2023", "2023 toyta camry xle", "xle camry"]:
+            results = list(search_variations(query))
+            self.assertEqual(results[0].full_name, "2023 Toyota Camry XLE", query)
+        self.assertEqual(list(search_variations("camry 2021")), [])
+
+    def test_autocomplete(self):
+        self.assertEqual(autocomplete("toyo"), ["Toyota Camry"])
+        response = self.client.get("/api/v1/autocomplete/", {"q": "toyo"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], ["Toyota Camry"])
+
+    def test_search_endpoint(self):
+        response = self.client.get("/api/v1/search/", {"q": "camry xle", "limit": 1})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["name"], "XLE")
+        self.assertEqual(
+            self.client.get("/api/v1/search/", {"q": "x"}).status_code, 400
+        )
+
+
+class ManufacturerUpsertTests(TestCase):
+    def test_normalized_names(self):
+        toyota = Manufacturer.objects.create(name="Toyota")
+        # The insert, then a lookup of the names that already existed
+        with self.assertNumQueries(2):
+            manufacturers, created = get_or_create_manufacturers(
+                ["TOYOTA ", "Honda", "honda"]
+            )
+        self.assertEqual(manufacturers["TOYOTA "], toyota)
+        self.assertEqual(manufacturers["Honda"], manufacturers["honda"])
+        self.assertEqual(created, {"Honda", "honda"})
+        self.assertEqual(Manufacturer.objects.count(), 2)
+
+        with self.assertNumQueries(1):
+            _, created = get_or_create_manufacturers(["Ford"])
+        self.assertEqual(created, {"Ford"})
+
+    def test_unique_constraints(self):
+        Manufacturer.objects.create(name="Toyota")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Manufacturer.objects.create(name=" toyota")
+        create_catalog(manufacturers=1, models=1, years=1, variations=1, prices=0)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            variation = Variation.objects.get()
+            Variation.objects.create(model_year=variation.model_year, name="Trim 0")
+
+    def test_bulk_get_or_create(self):
+        sedan = VehicleType.objects.create(name="Sedan")
+        with self.assertNumQueries(3):
+            types, created = bulk_get_or_create(
+                VehicleType, ("name",), [("Sedan",), ("Coupe",)]
+            )
+        self.assertEqual(types[("Sedan",)], sedan)
+        self.assertEqual(created, {("Coupe",)})
+        self.assertEqual(VehicleType.objects.count(), 2)
+
+
+class RemoveDuplicatesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Duplicates from before the unique constraints, dropped for this class only
+        with connection.schema_editor() as editor:
+            editor.remove_constraint(Manufacturer, Manufacturer._meta.constraints[0])
+            editor.alter_unique_together(Variation, [("model_year", "name")], [])
+        for name, trims in [("Toyota", ["XLE"]), (" toyota", ["XLE", "LE"])]:
+            model = Model.objects.create(
+                manufacturer=Manufacturer.objects.create(name=name), name="Camry"
+            )
+            model_year = ModelYear.objects.create(model=model, year=2023)
+            for trim in trims:
+                variation = Variation.objects.create(model_year=model_year, name=trim)
+                Price.objects.create(car=variation, price=25000)
+        refresh_comparisons()
+
+    def test_dry_run(self):
+        stats = remove_duplicates(dry_run=True)
+        self.assertEqual(stats["manufacturers"], (1, 1))
+        self.assertEqual(stats["variations"], (1, 1))
+        self.assertEqual(Manufacturer.objects.count(), 2)
+
+    def test_merge(self):
+        remove_duplicates()
+        manufacturer = Manufacturer.objects.get()
+        self.assertEqual(manufacturer.name, "Toyota")
+        self.assertEqual(Model.objects.get().manufacturer, manufacturer)
+        self.assertEqual(ModelYear.objects.count(), 1)
+        xle = Variation.objects.get(name="XLE")
+        self.assertEqual(xle.prices.count(), 2)
+        self.assertEqual(xle.current_price, xle.prices.latest("date"))
+        self.assertEqual(
+            set(
+                VariationComparison.objects.values_list("manufacturer_name", flat=True)
+            ),
+            {"Toyota"},
+        )
+        self.assertEqual(VariationComparison.objects.count(), 2)
+
+
+class DeleteAllTests(TestCase):
+    def setUp(self):
+        create_catalog(manufacturers=2, models=1, years=2, variations=1, prices=1)
+        refresh_comparisons()
+
+    def test_scoped_by_year(self):
+        call_command("delete_all", "--start-year", "2021", stdout=StringIO())
+        self.assertEqual(set(ModelYear.objects.values_list("year", flat=True)), {2020})
+        self.assertEqual(Price.objects.count(), 2)
+        self.assertEqual(VariationComparison.objects.count(), 2)
+
+    def test_scoped_by_manufacturer(self):
+        call_command("delete_all", "--manufacturer", "make 0", stdout=StringIO())
+        self.assertEqual(Manufacturer.objects.get().name, "Make 1")
+        self.assertEqual(Variation.objects.count(), 2)
+        self.assertEqual(Price.objects.count(), 2)
+
+    def test_truncate(self):
+        call_command("delete_all", stdout=StringIO())
+        self.assertFalse(Price.objects.exists())
+        self.assertFalse(Manufacturer.objects.exists())
+        self.assertTrue(VehicleType.objects.exists())
+
+
+VEHICLES_CSV = """\
+id,year,make,model,baseModel,fuelType,displ,cylinders,trany,drive,city08,highway08,comb08
+1,2023,Toyota,Camry,Camry,Regular,2.5,4,Automatic (S8),Front-Wheel Drive,28,39,32
+2,2023,Toyota,Camry,Camry,Regular,3.5,6,Automatic (S8),Front-Wheel Drive,22,32,26
+3,2023,Toyota,Camry Hybrid LE,Camry,Regular,2.5,4,Automatic (AV-S6),Front-Wheel Drive,51,53,52
+4,2023,Tesla,Model 3 Long Range AWD,Model 3,Electricity,,,Automatic (A1),All-Wheel Drive,134,126,131
+5,1999,Toyota,Camry,Camry,Regular,2.2,4,Automatic 4-spd,Front-Wheel Drive,20,28,23
+"""
+
+
+class FuelEconomyDatasetTests(TestCase):
+    def setUp(self):
+        toyota = Manufacturer.objects.create(name="TOYOTA")
+        # Matched to the dataset's "Camry" like the scrapers would
+        Model.objects.create(manufacturer=toyota, name="CAMRY")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "vehicles.csv.zip")
+        with zipfile.ZipFile(self.path, "w") as archive:
+            archive.writestr("vehicles.csv", VEHICLES_CSV)
+
+    def ingest(self):
+        call_command(
+            "ingest_fueleconomy_dataset",
+            self.path,
+            "--start-year",
+            "2000",
+            stdout=StringIO(),
+        )
+
+    def test_ingest(self):
+        self.ingest()
+        self.ingest()
+        self.assertEqual(
+            sorted(Manufacturer.objects.values_list("name", flat=True)),
+            ["TOYOTA", "Tesla"],
+        )
+        self.assertEqual(
+            sorted(str(variation) for variation in Variation.objects.all()),
+            [
+                "2023 TOYOTA CAMRY Base",
+                "2023 TOYOTA CAMRY Hybrid LE",
+                "2023 Tesla Model 3 Long Range AWD",
+            ],
+        )
+        camry = Variation.objects.get(name="Base")
+        self.assertEqual(
+            sorted(camry.fuel_economy.values_list("engine", "combined_mpg")),
+            [("2.5 L 4 cyl", 32), ("3.5 L 6 cyl", 26)],
+        )
+        tesla = FuelEconomy.objects.get(vehicle_id=4)
+        self.assertEqual((tesla.engine, tesla.fuel_type), ("", "Electricity"))
+        self.assertEqual(VariationComparison.objects.count(), 3)
+
+        # Fuel costs use the dataset's MPG, the flat assumption otherwise
+        Price.objects.create(car=camry, price=30000)
+        other = Variation.objects.create(model_year=camry.model_year, name="XSE")
+        Price.objects.create(car=other, price=30000)
+        _, result, _ = tco_for_variations([camry.pk, other.pk], Assumptions(mpg=25))
+        fuel = result.components["fuel"][:, 0]
+        self.assertAlmostEqual(fuel[0], 12000 * 3.5 / 29)
+        self.assertAlmostEqual(fuel[1], 12000 * 3.5 / 25)
+
+    def test_split_model(self):
+        self.assertEqual(split_model("F150", "F150 Pickup 2WD"), ("F150", "Pickup 2WD"))
+        self.assertEqual(split_model("", "Civic"), ("Civic", "Base"))
+        self.assertEqual(split_model("Sierra", "C15 Sierra"), ("Sierra", "C15 Sierra"))
+
+
+class ReplayServerTests(SimpleTestCase):
+    def test_serves_api_fixtures(self):
+        catalog = FixtureCatalog(manufacturers=2, models=6, trims=2, page_kb=1)
+        http = HttpClient()
+        with ReplayServer(catalog) as server:
+            models = http.fetch(
+                Request(
+                    f"{server.url}/vpic.nhtsa.dot.gov/api/vehicles/"
+                    "getmodelsformakeyear/make/Make 001/modelyear/2023?format=json"
+                )
+            ).json()
+            menu = http.fetch(
+                Request(
+                    f"{server.url}/www.fueleconomy.gov/ws/rest/vehicle/menu/model",
+                    params={"year": 2023, "make": "Make 001"},
+                )
+            )
+            missing = http.fetch(Request(f"{server.url}/example.com/"))
+        self.assertEqual(models["Count"], 6)
+        self.assertIn(b"<text>Model 005 Trim 1</text>", menu.content)
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(
+            server.requests,
+            {"vpic.nhtsa.dot.gov": 1, "www.fueleconomy.gov": 1, "example.com": 1},
+        )
+
+
+class ResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_hit_and_expiry(self):
+        cache = ResponseCache(self.directory)
+        request = Request("https://example.com/a", params={"year": 2023})
+        self.assertIsNone(cache.get(request))
+        cache.store(request, Response(request.url, 200, b"body", {"ETag": '"v1"'}))
+
+        entry = cache.get(request)
+        self.assertEqual(entry.response.content, b"body")
+        self.assertTrue(entry.is_fresh(60))
+        self.assertIsNone(cache.get(Request("https://example.com/a")))
+
+        entry.meta["stored_at"] -= 120
+        self.assertFalse(entry.is_fresh(60))
+        self.assertEqual(entry.validators(), {"If-None-Match": '"v1"'})
+
+    def test_not_modified_renews_entry(self):
+        cache = ResponseCache(self.directory)
+        request = Request("https://example.com/a")
+        cache.store(request, Response(request.url, 200, b"body", {"ETag": '"v1"'}))
+        stale = cache.get(request)
+        stale.meta["stored_at"] -= 120
+
+        response = cache.store(request, Response(request.url, 304, b""), stale)
+        self.assertEqual(response.content, b"body")
+        self.assertTrue(cache.get(request).is_fresh(60))
+
+        # Other statuses are passed through without touching the entry
+        error = cache.store(request, Response(request.url, 500, b"oops"), stale)
+        self.assertEqual(error.status_code, 500)
+        self.assertEqual(cache.get(request).response.content, b"body")
+
+    def test_evicts_least_recently_used(self):
+        cache = ResponseCache(self.directory, max_size=2500)
+        requests = [Request(f"https://example.com/{n}") for n in range(3)]
+        for n, request in enumerate(requests[:2]):
+            cache.store(request, Response(request.url, 200, b"x" * 1000))
+            os.utime(cache._path(request), (n, n))
+        # Reading an entry makes it the most recently used
+        cache.get(requests[0])
+
+        cache.store(requests[2], Response(requests[2].url, 200, b"x" * 1000))
+        self.assertIsNotNone(cache.get(requests[0]))
+        self.assertIsNone(cache.get(requests[1]))
+        self.assertIsNotNone(cache.get(requests[2]))
+        self.assertLessEqual(cache.size, 2500 * 0.9)
+
+
+class ScriptedHttpClient(HttpClient):
+    """Answers every request with the next of ``responses``"""
+
+    def __init__(self, responses, **kwargs):
+        super().__init__(**kwargs)
+        self.responses = responses
+
+    def get(self, request, headers):
+        return self.responses.pop(0)
+
+
+class RateLimitTests(SimpleTestCase):
+    def test_token_bucket(self):
+        now = [0.0]
+        bucket = TokenBucket(2, clock=lambda: now[0])
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0.0, 0.0, 0.5])
+        now[0] = 1.0
+        self.assertEqual(bucket.reserve(), 0.0)
+
+        # Throttling halves the rate and holds every request for the delay
+        bucket.throttled(5)
+        self.assertEqual(bucket.rate, 1)
+        self.assertEqual(bucket.reserve(), 5.0)
+        for _ in range(20):
+            bucket.succeeded()
+        self.assertEqual(bucket.rate, 2)
+
+    def test_retry_policy(self):
+        retry = RetryPolicy(
+            max_retries=2, max_backoff=60, jitter=lambda low, high: high
+        )
+        self.assertEqual([retry.delay(n) for n in (0, 3, 10)], [1, 8, 60])
+
+        def throttled(retry_after):
+            return Response("", 429, b"", {"Retry-After": retry_after})
+
+        self.assertEqual(retry.delay(0, throttled("3")), 3.0)
+        self.assertEqual(retry.delay(0, throttled("600")), 60)
+        later = timezone.now() + timedelta(seconds=30)
+        self.assertAlmostEqual(
+            retry.delay(0, throttled(format_datetime(later, usegmt=True))), 30, delta=2
+        )
+
+        self.assertTrue(retry.should_retry(0))
+        self.assertTrue(retry.should_retry(1, throttled("3")))
+        self.assertFalse(retry.should_retry(2, throttled("3")))
+        self.assertFalse(retry.should_retry(0, Response("", 404, b"")))
+
+    def test_retries_throttled_requests(self):
+        sleeps = []
+        http = ScriptedHttpClient(
+            [
+                Response("", 429, b"", {"Retry-After": "2"}),
+                Response("", 503, b""),
+                Response("", 200, b"ok"),
+            ],
+            limiter=RateLimiter(default_rate=100, clock=lambda: 0.0),
+            retry=RetryPolicy(jitter=lambda low, high: high),
+            sleep=sleeps.append,
+        )
+        response = http.fetch(Request("https://example.com/"))
+
+        self.assertEqual(response.content, b"ok")
+        # First token, Retry-After, the host's block, backoff, the block again
+        self.assertEqual(sleeps, [0.0, 2.0, 2.0, 2.0, 2.0])
+        self.assertEqual(http.limiter.bucket("https://example.com/").rate, 30)
+        self.assertEqual(
+            http.metrics.summary()["hosts"]["example.com"]["statuses"],
+            {"429": 1, "503": 1, "200": 1},
+        )
+
+    def test_gives_up_after_max_retries(self):
+        http = ScriptedHttpClient(
+            [Response("", 429, b"") for _ in range(3)],
+            retry=RetryPolicy(max_retries=1, jitter=lambda low, high: 0.0),
+            sleep=lambda seconds: None,
+        )
+        self.assertEqual(http.fetch(Request("https://example.com/")).status_code, 429)
+        self.assertEqual(len(http.responses), 1)
+
+
+class ParsingTests(SimpleTestCase):
+    def test_article(self):
+        html = FixtureCatalog(manufacturers=1, page_kb=4).wikipedia_page(
+            {}, "Make_000"
+        )[2]
+        article = parse_article(html.decode())
+        self.assertEqual(
+            article,
+            {
+                "description": "Make 000 is a fictional car manufacturer[1].",
+                "founded": "12 May 1950; 75 years ago",
+                "headquarters": "Springfield, Testland",
+                "website": "https://make000.example.com",
+            },
+        )
+        self.assertIsNone(parse_article("<p><b>No</b> infobox</p>"))
+
+    def test_google(self):
+        search = (
+            '<div><a href="/a">Reviews</a><a href="/b">All Configurations</a></div>'
+        )
+        self.assertEqual(find_link(search, "configurations"), "/b")
+        page = (
+            "<div><g-scrolling-carousel>"
+            '<a class="x klitem-tr">LE From $28,000</a>'
+            '<a class="klitem-tr y">XLE From $31,500</a>'
+            "</g-scrolling-carousel></div>"
+        )
+        carousel, items = parse_carousel(page)
+        self.assertTrue(carousel.startswith("<g-scrolling-carousel>"))
+        self.assertEqual(items, ["LE From $28,000", "XLE From $31,500"])
+        self.assertIsNone(parse_carousel("<div></div>"))
+
+
+class WikipediaScrapeTests(TransactionTestCase):
+    # The scrape writes through its worker threads' own connections
+    def test_batches_manufacturers(self):
+        catalog = FixtureCatalog(manufacturers=25, models=1, trims=1, page_kb=1)
+        for make in catalog.makes + ["Unknown Motors"]:
+            Manufacturer.objects.create(name=make)
+
+        stdout = StringIO()
+        with ReplayServer(catalog) as server:
+            call_command(
+                "scrape_wikipedia",
+                scrape_type="manufacturers",
+                start_year=2023,
+                end_year=2023,
+                no_cache=True,
+                api_base=server.url,
+                rate_limit=[(server.httpd.server_address[0], 1000000.0)],
+                stdout=stdout,
+            )
+
+        # Two query pages for the extracts, one search for the unknown name,
+        # then the claims and the country labels
+        self.assertEqual(
+            server.requests, {"en.wikipedia.org": 3, "www.wikidata.org": 2}
+        )
+        make = Manufacturer.objects.get(name="Make 024")
+        self.assertEqual(make.country, "Testland")
+        self.assertEqual(str(make.founded_date), "1950-05-12")
+        self.assertEqual(make.website, "https://make024.example.com")
+        self.assertEqual(make.description, "Make 024 is a fictional car manufacturer.")
+        self.assertEqual(Manufacturer.objects.get(name="Unknown Motors").country, "")
+        self.assertIn("Error Scraping Unknown Motors", stdout.getvalue())
+
+
+class VehicleTypeScrapeTests(TransactionTestCase):
+    # The scrape writes through its worker threads' own connections
+    def test_assigns_vehicle_types(self):
+        catalog = FixtureCatalog(manufacturers=2, models=6, trims=1)
+        for make in catalog.makes:
+            manufacturer = Manufacturer.objects.create(name=make)
+            for model in catalog.models[:5]:
+                Model.objects.create(manufacturer=manufacturer, name=model)
+
+        with ReplayServer(catalog) as server:
+            call_command(
+                "scrape_nhtsa",
+                scrape_type="vehicle_types",
+                start_year=2023,
+                end_year=2023,
+                no_cache=True,
+                api_base=server.url,
+                rate_limit=[(server.httpd.server_address[0], 1000000.0)],
+                stdout=StringIO(),
+            )
+
+        self.assertEqual(VehicleType.objects.count(), 3)
+        for model in Model.objects.select_related("vehicle_type"):
+            self.assertEqual(model.vehicle_type.name, catalog.vehicle_type(model.name))
+
+
+class WorkQueueTests(SimpleTestCase):
+    class Command(BaseAPICommand):
+        resume = False
+
+        def models_units(self, year):
+            return ["Make 000", "Make 001"]
+
+    def test_years_share_one_queue(self):
+        command = self.Command(stdout=StringIO())
+        newest = command.get_years(2021, 2023, "newest")
+        self.assertEqual(newest, [2023, 2022, 2021])
+        self.assertEqual(
+            command.get_work("models", newest),
+            [
+                (2023, "Make 000"),
+                (2023, "Make 001"),
+                (2022, "Make 000"),
+                (2022, "Make 001"),
+                (2021, "Make 000"),
+                (2021, "Make 001"),
+            ],
+        )
+        oldest = command.get_years(2021, 2023, "oldest")
+        self.assertEqual(
+            [year for year, _ in command.get_work("models", oldest)],
+            [2021, 2021, 2022, 2022, 2023, 2023],
+        )
+        # Years without units of their own are a single unit
+        self.assertEqual(command.get_work("manufacturers", [2023]), [(2023, None)])
+
+
+class BenchmarkTests(TransactionTestCase):
+    # The benchmark creates and drops its own database
+    def test_reports_every_stage(self):
+        Manufacturer.objects.create(name="Toyota")
+        database = connection.settings_dict["NAME"]
+        stdout = StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+            call_command(
+                "benchmark_scrapers",
+                manufacturers=2,
+                models=2,
+                trims=1,
+                page_kb=1,
+                latency=0,
+                output=output,
+                max_queries_per_unit=1000,
+                stdout=stdout,
+            )
+            with open(output) as f:
+                results = json.load(f)
+
+        self.assertEqual(
+            [(r["stage"], r["units"]) for r in results],
+            [
+                ("scrape_fueleconomy manufacturers", 1),
+                ("scrape_nhtsa models", 2),
+                ("scrape_nhtsa vehicle_types", 2),
+                ("scrape_fueleconomy variations", 2),
+                ("scrape_wikipedia manufacturers", 1),
+            ],
+        )
+        for r in results:
+            self.assertGreater(r["requests"], 0)
+            self.assertGreater(r["queries"], 0)
+            self.assertIn(r["stage"], stdout.getvalue())
+        self.assertIn("Benchmark finished", stdout.getvalue())
+
+        # The scrapes ran in a scratch database
+        self.assertEqual(connection.settings_dict["NAME"], database)
+        self.assertEqual(
+            list(Manufacturer.objects.values_list("name", flat=True)), ["Toyota"]
+        )
+        self.assertFalse(Model.objects.exists())
+        self.assertFalse(ScrapeCheckpoint.objects.exists())
+
+
+class ScrapeEngineTests(TransactionTestCase):
+    def scrape_models(self, server, **kwargs):
+        call_command(
+            "scrape_nhtsa",
+            scrape_type="models",
+            start_year=2022,
+            end_year=2023,
+            no_cache=True,
+            api_base=server.url,
+            rate_limit=[(server.httpd.server_address[0], 1000000.0)],
+            stdout=StringIO(),
+            **kwargs,
+        )
+        return set(
+            ModelYear.objects.values_list(
+                "model__manufacturer__name", "model__name", "year"
+            )
+        )
+
+    def test_async_engine_matches_threads(self):
+        catalog = FixtureCatalog(manufacturers=6, models=5, trims=1)
+        for make in catalog.makes:
+            Manufacturer.objects.create(name=make)
+
+        with ReplayServer(catalog) as server:
+            threaded = self.scrape_models(server)
+            Model.objects.all().delete()
+            scraped = self.scrape_models(server, engine="async", concurrency=4)
+
+        self.assertEqual(len(threaded), 6 * 5 * 2)
+        self.assertEqual(scraped, threaded)
+        self.assertEqual(
+            ScrapeCheckpoint.objects.filter(status=ScrapeCheckpoint.DONE).count(), 12
+        )
+
+
+class FlakyCatalog(FixtureCatalog):
+    """Answers NHTSA model requests for the ``failing`` makes with a 500"""
+
+    def __init__(self, failing, **kwargs):
+        super().__init__(**kwargs)
+        self.failing = set(failing)
+
+    def vpic_models(self, query, make, vehicle_type=None):
+        if make in self.failing:
+            return 500, "application/json", b'{"error": "flaky"}'
+        return super().vpic_models(query, make, vehicle_type)
+
+
+class ResumeTests(TransactionTestCase):
+    def test_resume_retries_failed_units(self):
+        catalog = FlakyCatalog(["Make 001"], manufacturers=3, models=2, trims=1)
+        for make in catalog.makes:
+            Manufacturer.objects.create(name=make)
+
+        def scrape(server, **kwargs):
+            call_command(
+                "scrape_nhtsa",
+                scrape_type="models",
+                start_year=2023,
+                end_year=2023,
+                no_cache=True,
+                max_retries=0,
+                api_base=server.url,
+                rate_limit=[(server.httpd.server_address[0], 1000000.0)],
+                stdout=StringIO(),
+                **kwargs,
+            )
+
+        def statuses():
+            return dict(ScrapeCheckpoint.objects.values_list("unit", "status"))
+
+        with ReplayServer(catalog) as server:
+            scrape(server)
+        self.assertEqual(
+            statuses(),
+            {
+                "Make 000": ScrapeCheckpoint.DONE,
+                "Make 001": ScrapeCheckpoint.FAILED,
+                "Make 002": ScrapeCheckpoint.DONE,
+            },
+        )
+        self.assertFalse(Model.objects.filter(manufacturer__name="Make 001").exists())
+
+        catalog.failing.clear()
+        with ReplayServer(catalog) as server:
+            scrape(server, resume=True)
+        self.assertEqual(server.requests, {"vpic.nhtsa.dot.gov": 1})
+        self.assertEqual(set(statuses().values()), {ScrapeCheckpoint.DONE})
+        self.assertEqual(
+            ModelYear.objects.filter(model__manufacturer__name="Make 001").count(), 2
+        )
+
+
+class MenuParsingTests(SimpleTestCase):
+    def test_iter_menu_items(self):
+        catalog = FixtureCatalog(manufacturers=1, models=3000, trims=1)
+        content = catalog.fueleconomy_models({"make": ["Make 000"]})[2]
+        items = iter_menu_items(Response("", 200, content), "text")
+        self.assertEqual(next(items), "Model 000 Trim 0")
+        self.assertEqual(len(list(items)), 2999)
+
+
+class ModelIndexTests(SimpleTestCase):
+    def test_match(self):
+        index = ModelIndex(
+            [(1, "Camry", "Toyota Camry"), (2, "Grand Cherokee", "Jeep Grand Cherokee")]
+        )
+        self.assertEqual(index.match("Camry Hybrid LE"), (1, "Hybrid LE"))
+        self.assertEqual(index.match("camry"), (1, "Base"))
+        self.assertEqual(index.match("Grand Cherokee 4WD"), (2, "4WD"))
+        self.assertEqual(index.match("Cherokee Trailhawk"), (2, "Trailhawk"))
+        self.assertIsNone(index.match("Corolla"))
+
+    def test_substring_fallback(self):
+        index = ModelIndex(
+            [(1, "Model3", "Tesla Model3"), (2, "E-Pace", "Jaguar E-Pace")]
+        )
+        # Containment does not have to fall on word boundaries
+        self.assertEqual(index.match("odel Long Range"), (1, "Long Range"))
+        self.assertEqual(index.match("Pace AWD"), (2, "AWD"))
+        self.assertEqual(index.match("Model"), (1, "Base"))
+        # The first name in sorted order wins, as with the database lookup
+        index = ModelIndex([(1, "XC90", "Volvo XC90"), (2, "C90", "Volvo C90")])
+        self.assertEqual(index.match("90 T8"), (2, "T8"))
+
+
+class QueryCounterTests(TransactionTestCase):
+    def test_with_unit_timer(self):
+        command = scrape_nhtsa.Command()
+        command.metrics = ScrapeMetrics()
+        timer = UnitTimer()
+        # The save opens the connection while the benchmark's counter is installed
+        connection.close()
+        with QueryCounter() as counter:
+            command.save("models", 2023, "Make 000", None, timer)
+            Manufacturer.objects.count()
+
+        self.assertGreater(timer.queries.count, 0)
+        self.assertEqual(counter.count, timer.queries.count + 1)
+        self.assertNotIn(timer.queries, connection.execute_wrappers)
+        self.assertNotIn(counter, connection.execute_wrappers)
+
+
+class ScrapeMetricsTests(SimpleTestCase):
+    def test_export(self):
+        metrics = ScrapeMetrics(command="scrape_nhtsa", scrape_type="models")
+        metrics.request("vpic.nhtsa.dot.gov", 200, 0.04)
+        metrics.request("vpic.nhtsa.dot.gov", 503, 0.3)
+        metrics.cache_hit("en.wikipedia.org")
+        timer = UnitTimer()
+        timer.seconds.update(network=0.5, parse=0.1, save=0.2)
+        metrics.unit_done(timer)
+        metrics.count_rows("model", created=3)
+
+        summary = metrics.summary()
+        self.assertEqual(summary["bottleneck"], "network")
+        host = summary["hosts"]["vpic.nhtsa.dot.gov"]
+        self.assertEqual(host["statuses"], {"200": 1, "503": 1})
+        self.assertEqual(host["latency"]["p50"], 0.05)
+        self.assertEqual(summary["hosts"]["en.wikipedia.org"]["cache_hits"], 1)
+        self.assertEqual(summary["rows"], {"model.created": 3})
+
+        text = metrics.prometheus()
+        self.assertIn(
+            'scrape_responses_total{command="scrape_nhtsa",scrape_type="models",'
+            'host="vpic.nhtsa.dot.gov",status="503"} 1',
+            text,
+        )
+        self.assertIn("# TYPE scrape_unit_phase_seconds histogram", text)
+
+
+class TCOTests(SimpleTestCase):
+    def test_single_car(self):
+        assumptions = Assumptions(
+            years=2,
+            annual_miles=10000,
+            fuel_price=4.0,
+            mpg=40,
+            depreciation=[0.5],
+            insurance=1000,
+            insurance_growth=0,
+            maintenance=100,
+            maintenance_growth=1.0,
+        )
+        result = compute_tco([20000], 40, assumptions)
+        self.assertEqual(result.components["depreciation"].tolist(), [[10000, 5000]])
+        self.assertEqual(result.components["fuel"].tolist(), [[1000, 1000]])
+        self.assertEqual(result.components["maintenance"].tolist(), [[100, 200]])
+        self.assertEqual(result.per_year.tolist(), [[12100, 7200]])
+        self.assertEqual(result.cumulative.tolist(), [[12100, 19300]])
+        self.assertEqual(result.resale_value.tolist(), [5000])
+
+    def test_many_cars(self):
+        result = compute_tco([30000, 20000, 40000], [20, 40, 30], Assumptions(years=15))
+        self.assertEqual(result.per_year.shape, (3, 15))
+        # Same assumptions, so the cheaper car to buy and run costs less to own
+        self.assertLess(result.total[1], result.total[0])
+
+    def test_depreciation_curve_repeats_last_rate(self):
+        rates = Assumptions(years=4, depreciation=[0.3, 0.1]).depreciation_rates()
+        self.assertEqual(rates.tolist(), [0.3, 0.1, 0.1, 0.1])
+
+    def test_rejects_empty_horizon(self):
+        with self.assertRaises(ValueError):
+            Assumptions(years=0)
+        with self.assertRaises(ValueError):
+            Assumptions(depreciation=[])
+        with self.assertRaisesMessage(CommandError, "--years must be at least 1"):
+            call_command("compute_tco", "1", years=0, stdout=StringIO())
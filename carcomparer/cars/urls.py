@@ -0,0 +1,19 @@
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
+from . import views
+
+router = DefaultRouter()
+router.register("manufacturers", views.ManufacturerViewSet)
+router.register("models", views.CarModelViewSet)
+router.register("model-years", views.ModelYearViewSet)
+router.register("variations", views.VariationViewSet)
+router.register("prices", views.PriceViewSet)
+router.register("comparisons", views.VariationComparisonViewSet)
+
+urlpatterns = [
+    path("tco/", views.TCOView.as_view(), name="tco"),
+    path("search/", views.SearchView.as_view(), name="search"),
+    path("autocomplete/", views.AutocompleteView.as_view(), name="autocomplete"),
+    path("price-history/", views.PriceHistoryView.as_view(), name="price-history"),
+    path("", include(router.urls)),
+]
@@ -1,3 +1,184 @@
-from django.shortcuts import render
+from django.core.exceptions import ValidationError
+from rest_framework import exceptions, viewsets
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .models import (
+    Manufacturer,
+    Model,
+    ModelYear,
+    Price,
+    Variation,
+    VariationComparison,
+)
+from .serializers import (
+    CarModelSerializer,
+    ManufacturerSerializer,
+    ModelYearSerializer,
+    PriceHistoryQuerySerializer,
+    PriceSerializer,
+    SearchQuerySerializer,
+    TCOQuerySerializer,
+    VariationComparisonSerializer,
+    VariationSearchSerializer,
+    VariationSerializer,
+)
+from .price_history import price_history
+from .search import autocomplete, search_variations
+from .tco import Assumptions, tco_for_variations
 
-# Create your views here.
+
+class CatalogViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Read only endpoint over one catalog table.
+
+    ``filter_fields`` maps query parameters to lookups, e.g. ``?manufacturer=3``.
+    ``__in`` lookups take a comma separated list, e.g. ``?variations=1,2,3``.
+    """
+
+    filter_fields = {}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        filters = {}
+        for param, lookup in self.filter_fields.items():
+            if param in self.request.query_params:
+                value = self.request.query_params[param]
+                if lookup.endswith("__in"):
+                    value = value.split(",")
+                filters[lookup] = value
+        try:
+            return queryset.filter(**filters)
+        except (ValueError, ValidationError) as exc:
+            raise exceptions.ValidationError(str(exc))
+
+
+class ManufacturerViewSet(CatalogViewSet):
+    queryset = Manufacturer.objects.all()
+    serializer_class = ManufacturerSerializer
+    filter_fields = {"name": "name__iexact", "country": "country__iexact"}
+
+
+class CarModelViewSet(CatalogViewSet):
+    queryset = Model.objects.select_related("manufacturer", "vehicle_type")
+    serializer_class = CarModelSerializer
+    filter_fields = {"manufacturer": "manufacturer", "vehicle_type": "vehicle_type"}
+
+
+class ModelYearViewSet(CatalogViewSet):
+    queryset = ModelYear.objects.select_related("model__manufacturer").prefetch_related(
+        "variations"
+    )
+    serializer_class = ModelYearSerializer
+    filter_fields = {"model": "model", "year": "year"}
+
+
+class VariationViewSet(CatalogViewSet):
+    queryset = Variation.objects.with_current_price().select_related(
+        "model_year__model__manufacturer"
+    )
+    serializer_class = VariationSerializer
+    filter_fields = {
+        "model_year": "model_year",
+        "model": "model_year__model",
+        "manufacturer": "model_year__model__manufacturer",
+        "year": "model_year__year",
+    }
+
+
+class PriceViewSet(CatalogViewSet):
+    queryset = Price.objects.all()
+    serializer_class = PriceSerializer
+    filter_fields = {"car": "car"}
+
+
+class VariationComparisonViewSet(CatalogViewSet):
+    """Side by side comparison rows, read from the precomputed table only"""
+
+    queryset = VariationComparison.objects.all()
+    serializer_class = VariationComparisonSerializer
+    filter_fields = {
+        "variations": "variation__in",
+        "manufacturer": "manufacturer",
+        "model": "model",
+        "year": "year",
+        "vehicle_type": "vehicle_type_name__iexact",
+    }
+
+
+class TCOView(APIView):
+    """
+    Cost of ownership of up to 500 variations, e.g.
+    ``/api/v1/tco/?variations=1,2,3&years=7&annual_miles=15000``
+    """
+
+    def get(self, request):
+        query = TCOQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = dict(query.validated_data)
+        variation_ids = params.pop("variations")
+        assumptions = Assumptions(**params)
+
+        variations, result, missing = tco_for_variations(variation_ids, assumptions)
+        rows = []
+        for i, variation in enumerate(variations):
+            rows.append(
+                {
+                    "variation": variation.pk,
+                    "full_name": variation.full_name,
+                    "price": variation.current_price.price,
+                    **result.row(i),
+                }
+            )
+        return Response({"assumptions": params, "results": rows, "missing": missing})
+
+
+class PriceHistoryView(APIView):
+    """
+    Price history of up to 500 variations, e.g.
+    ``/api/v1/price-history/?variations=1,2,3&start=2024-01-01T00:00Z``
+
+    Defaults to the last year. Older points are daily or weekly aggregates.
+    """
+
+    def get(self, request):
+        query = PriceHistoryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        history = price_history(params["variations"], params["start"], params["end"])
+        return Response(
+            {
+                "start": params["start"],
+                "end": params["end"],
+                "results": history,
+            }
+        )
+
+
+class SearchView(APIView):
+    """
+    Ranked, typo tolerant variation search, e.g.
+    ``/api/v1/search/?q=camry xle 2023&limit=20``
+    """
+
+    def get(self, request):
+        query = SearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        rows = search_variations(
+            query.validated_data["q"], limit=query.validated_data["limit"]
+        )
+        serializer = VariationSearchSerializer(
+            rows, many=True, context={"request": request}
+        )
+        return Response({"results": serializer.data})
+
+
+class AutocompleteView(APIView):
+    """Model name suggestions while typing, e.g. ``/api/v1/autocomplete/?q=toyo``"""
+
+    def get(self, request):
+        query = SearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        suggestions = autocomplete(
+            query.validated_data["q"], limit=query.validated_data["limit"]
+        )
+        return Response({"results": suggestions})
@@ -38,6 +38,8 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
+    "rest_framework",
     "carcomparer.cars",
 ]
 
@@ -123,6 +125,14 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+
+REST_FRAMEWORK = {
+    "DEFAULT_PAGINATION_CLASS": "carcomparer.cars.pagination.CatalogCursorPagination",
+    "PAGE_SIZE": 100,
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 